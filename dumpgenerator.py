@@ -20,26 +20,45 @@
 #     https://github.com/WikiTeam/wikiteam/wiki
 
 try:
-    from kitchen.text.converters import getwriter, to_unicode
+    from kitchen.text.converters import getwriter
 except ImportError:
     print "Please install the kitchen module."
+import bz2
+import collections
+import codecs
 import cookielib
 import cPickle
 import datetime
+import hashlib
+import io
+import itertools
+import Queue
+import random
 import sys
 try:
     import argparse
 except ImportError:
     print "Please install the argparse module."
     sys.exit(1)
+import email.utils
 import json
+try:
+    import lzma
+except ImportError:
+    try:
+        from backports import lzma
+    except ImportError:
+        lzma = None  # only needed for --compress xz
 try:
     from hashlib import md5
 except ImportError:             # Python 2.4 compatibility
     from md5 import new as md5
 import os
 import re
+import shutil
 import subprocess
+import tempfile
+import threading
 try:
     import requests
 except ImportError:
@@ -49,17 +68,18 @@ try:
     import wikitools
 except ImportError:
     print "Please install the wikitools 1.3+ module if you want to use --xmlrevisions."
-try:
-    from lxml import etree
-    from lxml.builder import E
-except ImportError:
-    print "Please install the lxml module if you want to use --xmlrevisions."
 import time
 import urllib
 try:
     from urlparse import urlparse, urlunparse
 except ImportError:
     from urllib.parse import urlparse, urlunparse
+from xml.sax.saxutils import escape
+import zlib
+try:
+    import zstandard
+except ImportError:
+    zstandard = None  # only needed for --compress zstd
 UTF8Writer = getwriter('utf8')
 sys.stdout = UTF8Writer(sys.stdout)
 
@@ -90,11 +110,216 @@ def truncateFilename(other={}, filename=''):
 
 def delay(config={}, session=None):
     """ Add a delay if configured for that """
+    if session is not None and getattr(session, 'ratelimiter', None):
+        # the session paces every request itself
+        return
     if config['delay'] > 0:
         print 'Sleeping... %d seconds...' % (config['delay'])
         time.sleep(config['delay'])
 
 
+def backoff(retry=1, maxseconds=100):
+    """ Seconds to wait before a retry: doubling from 5 seconds up to
+        maxseconds, with some jitter so threads do not retry together """
+    return min(maxseconds, 5 * 2 ** (retry - 1)) * random.uniform(0.5, 1)
+
+
+class RateLimiter(object):
+    """ Paces the requests to the wiki, adapting their rate (AIMD): while the
+        wiki answers fine the rate grows by about one request per second
+        every second, up to maxrate, and it halves on 429 and 5xx responses,
+        maxlag errors and connection errors. Retry-After pauses everything """
+
+    def __init__(self, maxrate=0, minrate=0.05):
+        # without maxrate, requests go as fast as the wiki answers until it
+        # complains for the first time
+        self.maxrate = maxrate or float('inf')
+        self.minrate = minrate
+        self.rate = self.maxrate
+        self.next = 0  # time of the next request
+        self.paused = 0  # no request before this time (Retry-After)
+        self.decreased = 0  # time of the last decrease
+        self.recent = collections.deque(maxlen=20)  # times of the last requests
+        self.lock = threading.Lock()
+
+    def wait(self):
+        """ Sleep until the next request can be sent """
+        with self.lock:
+            now = time.time()
+            start = max(now, self.next, self.paused)
+            self.next = start + 1.0 / self.rate
+            self.recent.append(start)
+        if start - now >= 1:
+            print '    Sleeping... %d seconds...' % (start - now)
+        if start > now:
+            time.sleep(start - now)
+
+    def success(self):
+        with self.lock:
+            if self.rate < self.maxrate:
+                self.rate = min(self.maxrate, self.rate + 1.0 / self.rate)
+
+    def failure(self, retryafter=0):
+        with self.lock:
+            now = time.time()
+            if retryafter:
+                self.paused = max(self.paused, now + min(retryafter, 600))
+            # the responses to requests sent at the old rate may keep
+            # failing for a while: decrease once every second at most
+            if now - self.decreased < 1:
+                return
+            self.decreased = now
+            if self.rate == float('inf'):
+                # start from the rate the requests actually had
+                self.rate = 1.0
+                if len(self.recent) > 1 and self.recent[-1] > self.recent[0]:
+                    self.rate = (len(self.recent) - 1) / (self.recent[-1] - self.recent[0])
+            self.rate = max(self.minrate, self.rate / 2)
+            print '    Slowing down to %.2f requests per second' % (self.rate)
+
+    def observe(self, response):
+        """ Adapt the rate to a response of the wiki """
+        if response.status_code == 429 or response.status_code >= 500 or \
+                response.headers.get('MediaWiki-API-Error') == 'maxlag':
+            self.failure(retryafter=parseRetryAfter(response.headers.get('Retry-After')))
+        else:
+            self.success()
+
+
+def parseRetryAfter(value=None):
+    """ Seconds in a Retry-After header, given as seconds or as a date """
+    if not value:
+        return 0
+    try:
+        return max(0, float(value))
+    except ValueError:
+        date = email.utils.parsedate_tz(value)
+        if date:
+            return max(0, email.utils.mktime_tz(date) - time.time())
+    return 0
+
+
+class RateLimitedAdapter(requests.adapters.HTTPAdapter):
+    """ Transport adapter sending requests no faster than its RateLimiter
+        allows, and telling it how the wiki answered """
+
+    def __init__(self, ratelimiter=None, **kwargs):
+        self.ratelimiter = ratelimiter
+        super(RateLimitedAdapter, self).__init__(**kwargs)
+
+    def send(self, request, **kwargs):
+        self.ratelimiter.wait()
+        try:
+            response = super(RateLimitedAdapter, self).send(request, **kwargs)
+        except requests.exceptions.ConnectionError:
+            self.ratelimiter.failure()
+            raise
+        self.ratelimiter.observe(response)
+        return response
+
+
+def createSession(maxrate=0, poolsize=10, cookies=None):
+    """ The one HTTP session every request of a dump goes through: its
+        connections are kept alive and pooled, its pace is shared by all
+        the threads and it asks for compressed responses """
+    session = requests.Session()
+    session.ratelimiter = RateLimiter(maxrate=maxrate)
+    try:
+        from requests.packages.urllib3.util.retry import Retry
+        # Courtesy datashaman https://stackoverflow.com/a/35504626
+        # Only failed connections: 429 and 5xx answers come back to the
+        # callers, which retry them at the pace of the RateLimiter
+        __retries__ = Retry(total=5,
+                        backoff_factor=2)
+    except:
+        # Our urllib3/requests is too old
+        __retries__ = 0
+    # a pool per host (the wiki, its upload server...) with a kept-alive
+    # connection for every thread
+    for prefix in ['https://', 'http://']:
+        session.mount(prefix, RateLimitedAdapter(
+            ratelimiter=session.ratelimiter,
+            max_retries=__retries__,
+            pool_connections=10,
+            pool_maxsize=poolsize))
+    if cookies is not None:
+        session.cookies = cookies
+    # XML exports and API responses are text and shrink about 10 times
+    session.headers.update({
+        'User-Agent': getUserAgent(),
+        'Accept-Encoding': 'gzip, deflate',
+        'Connection': 'keep-alive'})
+    return session
+
+
+def orderedMap(function=None, items=[], workers=1, window=0, priority=None):
+    """ Apply function to every item using a pool of threads, yielding the
+        results in the same order as items; within the window of items
+        fetched in advance, those with the highest priority(item) start
+        first """
+    # With one worker everything happens in the calling thread, as before
+    if workers <= 1:
+        for item in items:
+            yield function(item)
+        return
+
+    # bound the number of items fetched in advance, so results waiting to
+    # be consumed do not pile up in memory
+    window = window or workers * 2
+    tasks = Queue.PriorityQueue()
+    cancelled = threading.Event()
+    # the order of the items among the same priority, and of the ends of
+    # the workers after every item
+    sequence = itertools.count()
+
+    def worker():
+        while True:
+            job = tasks.get()[2]
+            if job is None:
+                break
+            if not cancelled.is_set():
+                try:
+                    job['result'] = function(job['item'])
+                except BaseException:
+                    job['error'] = sys.exc_info()
+            job['done'].set()
+
+    threads = []
+    for i in range(workers):
+        t = threading.Thread(target=worker)
+        t.daemon = True
+        t.start()
+        threads.append(t)
+
+    pending = collections.deque()
+    try:
+        for item in items:
+            job = {'item': item, 'done': threading.Event()}
+            pending.append(job)
+            tasks.put((priority and -priority(item) or 0, next(sequence), job))
+            if len(pending) >= window:
+                yield _orderedMapResult(pending.popleft())
+        while pending:
+            yield _orderedMapResult(pending.popleft())
+    finally:
+        # if aborted (exception or generator closed), drop what is queued
+        cancelled.set()
+        for t in threads:
+            tasks.put((float('inf'), next(sequence), None))
+    for t in threads:
+        t.join()
+
+
+def _orderedMapResult(job):
+    """ Wait for a job of orderedMap and return its result, or raise its error """
+    # a timeout keeps the main thread responsive to Ctrl-C
+    while not job['done'].wait(1):
+        pass
+    if 'error' in job:
+        raise job['error'][0], job['error'][1], job['error'][2]
+    return job['result']
+
+
 def cleanHTML(raw=''):
     """ Extract only the real wiki content and remove rubbish """
     """ This function is ONLY used to retrieve page titles and file names when no API is available """
@@ -157,6 +382,47 @@ def handleStatusCode(response):
         sys.exit(1)
 
 
+def apiRequest(config={}, params={}, session=None, timeout=30):
+    """ Send a request to the API and return its response. maxlag is sent
+        with it, so a wiki with lagged replicas asks to wait; on those
+        answers, on 429 and 5xx and on connection errors, wait as long as
+        the wiki says (Retry-After) and retry, instead of giving up """
+    params = dict(params)
+    maxlag = config.get('maxlag', 5)
+    if maxlag > 0:
+        params['maxlag'] = maxlag
+    maxretries = config.get('retries', 5)
+    retry = 0
+    lagged = 0
+    while True:
+        r = None
+        try:
+            r = session.post(url=config['api'], params=params, timeout=timeout)
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+            print '    Connection error: %s' % (str(e))
+            if retry >= maxretries:
+                raise
+        if r is not None:
+            if r.headers.get('MediaWiki-API-Error') == 'maxlag' or \
+                    (r.text.startswith('{"error"') and getJSON(r)['error'].get('code') == 'maxlag'):
+                # the wiki is fine, but busy: wait for it as long as asked
+                lagged += 1
+                wait = parseRetryAfter(r.headers.get('Retry-After')) or 5
+                print '    The wiki is lagged, waiting %d seconds...' % (wait)
+                time.sleep(wait)
+                if lagged >= maxretries * 10:
+                    print '    The wiki is lagged for too long, not sending maxlag anymore'
+                    del params['maxlag']
+                continue
+            if (r.status_code != 429 and r.status_code < 500) or retry >= maxretries:
+                handleStatusCode(r)
+                return r
+        retry += 1
+        wait = r is not None and parseRetryAfter(r.headers.get('Retry-After')) or backoff(retry=retry)
+        print '    API request failed, waiting %d seconds and retrying...' % (wait)
+        time.sleep(wait)
+
+
 def getNamespacesScraper(config={}, session=None):
     """ Hackishly gets the list of namespaces names and ids from the dropdown in the HTML of Special:AllPages """
     """ Function called if no API is available """
@@ -199,14 +465,14 @@ def getNamespacesAPI(config={}, session=None):
     namespaces = config['namespaces']
     namespacenames = {0: ''}  # main is 0, no prefix
     if namespaces:
-        r = session.post(
-            url=config['api'],
+        r = apiRequest(
+            config=config,
             params={
                 'action': 'query',
                 'meta': 'siteinfo',
                 'siprop': 'namespaces',
                 'format': 'json'},
-            timeout=30
+            session=session
         )
         result = getJSON(r)
         delay(config=config, session=session)
@@ -245,84 +511,158 @@ def getNamespacesAPI(config={}, session=None):
     return namespaces, namespacenames
 
 
+class TitleSet(object):
+    """ Set of the titles seen so far, as utf-8 strings, so a unicode title
+        and its utf-8 encoding are the same title """
+
+    def __init__(self):
+        self.titles = set()
+
+    def key(self, title=''):
+        if isinstance(title, unicode):
+            return title.encode('utf-8')
+        return title
+
+    def add(self, title=''):
+        """ Add title; return False if it was seen before """
+        if isinstance(title, unicode):
+            title = title.encode('utf-8')
+        titles = self.titles
+        if title in titles:
+            return False
+        titles.add(title)
+        return True
+
+    def __contains__(self, title):
+        return self.key(title) in self.titles
+
+    def __len__(self):
+        return len(self.titles)
+
+
 def getPageTitlesAPI(config={}, session=None):
     """ Uses the API to get the list of page titles """
-    titles = []
     namespaces, namespacenames = getNamespacesAPI(
         config=config, session=session)
     for namespace in namespaces:
         if namespace in config['exnamespaces']:
             print '    Skipping namespace = %d' % (namespace)
-            continue
+    namespaces = [namespace for namespace in namespaces if namespace not in config['exnamespaces']]
 
-        c = 0
-        print '    Retrieving titles in the namespace %d' % (namespace)
-        apfrom = '!'
-        while apfrom:
-            sys.stderr.write('.')  # progress
-            params = {
-                'action': 'query',
-                'list': 'allpages',
-                'apnamespace': namespace,
-                'apfrom': apfrom.encode('utf-8'),
-                'format': 'json',
-                'aplimit': 500}
-
-            retryCount = 0
-            while retryCount < config["retries"]:
-                try:
-                    r = session.post(url=config['api'], data=params, timeout=30)
+    workers = min(config.get('workers', 1), len(namespaces))
+    if workers <= 1:
+        for namespace in namespaces:
+            for titles in getPageTitlesNamespaceAPI(config=config, namespace=namespace, session=session):
+                for title in titles:
+                    yield title
+        return
+
+    # several namespaces are listed at once by config['workers'] threads,
+    # each namespace into its own queue; the titles are yielded in the
+    # order of the namespaces all the same
+    pending = Queue.Queue()
+    for i in range(len(namespaces)):
+        pending.put(i)
+    queues = [Queue.Queue() for namespace in namespaces]
+    cancelled = threading.Event()
+
+    def lister():
+        while not cancelled.is_set():
+            try:
+                i = pending.get_nowait()
+            except Queue.Empty:
+                break
+            try:
+                for titles in getPageTitlesNamespaceAPI(config=config, namespace=namespaces[i], session=session):
+                    if cancelled.is_set():
+                        break
+                    queues[i].put(titles)
+                queues[i].put(None)
+            except BaseException:
+                queues[i].put(sys.exc_info())
+
+    for i in range(workers):
+        t = threading.Thread(target=lister)
+        t.daemon = True
+        t.start()
+    try:
+        for queue in queues:
+            while True:
+                titles = queue.get()
+                if titles is None:
                     break
-                except ConnectionError as err:
-                    print "Connection error: %s" % (str(err),)
-                    retryCount += 1
-                    time.sleep(20)
-            handleStatusCode(r)
-            # FIXME Handle HTTP errors here!
-            jsontitles = getJSON(r)
+                elif isinstance(titles, tuple):
+                    raise titles[0], titles[1], titles[2]
+                for title in titles:
+                    yield title
+    finally:
+        cancelled.set()
+
+
+def getPageTitlesNamespaceAPI(config={}, namespace=0, session=None):
+    """ Uses the API to get the titles of a namespace, yielding a list for
+        every request """
+    titles = TitleSet()
+    c = 0
+    print '    Retrieving titles in the namespace %d' % (namespace)
+    apfrom = '!'
+    while apfrom:
+        sys.stderr.write('.')  # progress
+        params = {
+            'action': 'query',
+            'list': 'allpages',
+            'apnamespace': namespace,
+            'apfrom': apfrom.encode('utf-8'),
+            'format': 'json',
+            'aplimit': 500}
+
+        r = apiRequest(config=config, params=params, session=session)
+        jsontitles = getJSON(r)
+        apfrom = ''
+        if 'query-continue' in jsontitles and 'allpages' in jsontitles[
+                'query-continue']:
+            if 'apcontinue' in jsontitles['query-continue']['allpages']:
+                apfrom = jsontitles[
+                    'query-continue']['allpages']['apcontinue']
+            elif 'apfrom' in jsontitles['query-continue']['allpages']:
+                apfrom = jsontitles['query-continue']['allpages']['apfrom']
+        elif 'continue' in jsontitles:
+            if 'apcontinue' in jsontitles['continue']:
+                apfrom = jsontitles['continue']['apcontinue']
+            elif 'apfrom' in jsontitles['continue']:
+                apfrom = jsontitles['continue']['apfrom']
+
+        # print apfrom
+        # print jsontitles
+        try:
+            allpages = jsontitles['query']['allpages']
+        except KeyError:
+            print "The allpages API returned nothing. Exit."
+            sys.exit(1)
+
+        # Hack for old versions of MediaWiki API where result is dict
+        if isinstance(allpages, dict):
+            allpages = allpages.values()
+        duplicate = None
+        for page in allpages:
+            if not titles.add(page['title']) and duplicate is None:
+                duplicate = page['title']
+        yield [page['title'] for page in allpages]
+        c += len(allpages)
+
+        if duplicate is not None:
+            print 'Probably a loop, switching to next namespace. Duplicate title:'
+            print duplicate
             apfrom = ''
-            if 'query-continue' in jsontitles and 'allpages' in jsontitles[
-                    'query-continue']:
-                if 'apcontinue' in jsontitles['query-continue']['allpages']:
-                    apfrom = jsontitles[
-                        'query-continue']['allpages']['apcontinue']
-                elif 'apfrom' in jsontitles['query-continue']['allpages']:
-                    apfrom = jsontitles['query-continue']['allpages']['apfrom']
-            elif 'continue' in jsontitles:
-                if 'apcontinue' in jsontitles['continue']:
-                    apfrom = jsontitles['continue']['apcontinue']
-                elif 'apfrom' in jsontitles['continue']:
-                    apfrom = jsontitles['continue']['apfrom']
-
-            # print apfrom
-            # print jsontitles
-            try:
-                allpages = jsontitles['query']['allpages']
-            except KeyError:
-                print "The allpages API returned nothing. Exit."
-                sys.exit(1)
 
-            # Hack for old versions of MediaWiki API where result is dict
-            if isinstance(allpages, dict):
-                allpages = allpages.values()
-            for page in allpages:
-                title = page['title']
-                titles.append(title)
-                yield title
-            c += len(allpages)
-
-            if len(titles) != len(set(titles)):
-                print 'Probably a loop, switching to next namespace. Duplicate title:'
-                print title
-                titles = list(set(titles))
-                apfrom = ''
+        delay(config=config, session=session)
+    print '    %d titles retrieved in the namespace %d' % (c, namespace)
 
-            delay(config=config, session=session)
-        print '    %d titles retrieved in the namespace %d' % (c, namespace)
 
 def getPageTitlesScraper(config={}, session=None):
     """ Scrape the list of page titles from Special:Allpages """
     titles = []
+    seen = TitleSet()
     namespaces, namespacenames = getNamespacesScraper(
         config=config, session=session)
     for namespace in namespaces:
@@ -397,13 +737,185 @@ def getPageTitlesScraper(config={}, session=None):
         for i in m:
             t = undoHTMLEntities(text=i.group('title'))
             if not t.startswith('Special:'):
-                if t not in titles:
+                if seen.add(t):
                     titles.append(t)
                     c += 1
         print '    %d titles retrieved in the namespace %d' % (c, namespace)
     return titles
 
 
+def getAPIList(config={}, params={}, session=None):
+    """ Yield the items of the list query in params, following the
+        continuation of both old and new API versions """
+    params = dict(params, action='query', format='json')
+    listname = params['list']
+    while True:
+        r = apiRequest(config=config, params=params, session=session)
+        jsonlist = getJSON(r)
+        delay(config=config, session=session)
+        if 'error' in jsonlist:
+            raise KeyError(jsonlist['error'].get('code', listname))
+        if 'query' not in jsonlist and \
+                "Unrecognized value for parameter 'list': %s" % (listname) in json.dumps(jsonlist.get('warnings', {})):
+            # older MediaWiki only warns about the lists it does not have
+            raise KeyError(listname)
+        for item in jsonlist.get('query', {}).get(listname, []):
+            yield item
+        if 'continue' in jsonlist:
+            params.update(jsonlist['continue'])
+        elif 'query-continue' in jsonlist and listname in jsonlist['query-continue']:
+            params.update(jsonlist['query-continue'][listname])
+        else:
+            break
+
+
+def getChangesAPI(config={}, session=None):
+    """ Uses the API to get the pages edited, created, moved and deleted
+        since config['since'] """
+    since = config['since']
+    # the next incremental dump starts here; later edits exported by this
+    # one are repeated in the next, but none is lost
+    until = datetime.datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%SZ')
+    print 'Loading changes since %s' % (since)
+
+    def wanted(namespace):
+        return ('all' in config['namespaces'] or namespace in config['namespaces']) and \
+            namespace not in config['exnamespaces']
+
+    # recentchanges only keeps the last weeks: if it does not go back to
+    # since, list the revisions with allrevisions (MediaWiki 1.27+)
+    edits = []
+    oldest = ''
+    for change in getAPIList(config=config, session=session, params={
+            'list': 'recentchanges', 'rcdir': 'newer', 'rcprop': 'timestamp',
+            'rclimit': 1}):
+        oldest = change['timestamp']
+        break
+    if oldest and oldest <= since:
+        print '    Retrieving edits from recent changes'
+        edits = getAPIList(config=config, session=session, params={
+            'list': 'recentchanges', 'rcstart': since, 'rcdir': 'newer',
+            'rcprop': 'title|timestamp', 'rctype': 'edit|new', 'rclimit': 500})
+    else:
+        print '    Recent changes start at %s, retrieving edits from all revisions' % (oldest or 'unknown')
+        edits = getAPIList(config=config, session=session, params={
+            'list': 'allrevisions', 'arvstart': since, 'arvdir': 'newer',
+            'arvprop': 'timestamp', 'arvlimit': 500})
+
+    # every change as (timestamp, title, event, target)
+    events = []
+    try:
+        for edit in edits:
+            if wanted(edit['ns']):
+                # allrevisions lists the revisions of each page
+                timestamp = edit.get('timestamp') or max(
+                    [revision['timestamp'] for revision in edit.get('revisions', [])] or [since])
+                events.append((timestamp, edit['title'], 'edit', None))
+    except KeyError:
+        print 'Warning: could not list all revisions, wiki too old. Edits before %s are missing' % (oldest)
+        logerror(
+            config=config,
+            text=u'The wiki has no list of all revisions and its recent changes start at %s: the edits between %s and then are missing' % (oldest, since))
+        for edit in getAPIList(config=config, session=session, params={
+                'list': 'recentchanges', 'rcstart': since, 'rcdir': 'newer',
+                'rcprop': 'title|timestamp', 'rctype': 'edit|new', 'rclimit': 500}):
+            if wanted(edit['ns']):
+                events.append((edit['timestamp'], edit['title'], 'edit', None))
+
+    print '    Retrieving moves and deletions from the logs'
+    for letype in ['move', 'delete']:
+        for logevent in getAPIList(config=config, session=session, params={
+                'list': 'logevents', 'letype': letype, 'lestart': since,
+                'ledir': 'newer', 'leprop': 'title|type|timestamp|details',
+                'lelimit': 500}):
+            if 'title' not in logevent or not wanted(logevent['ns']):
+                continue  # suppressed
+            if letype == 'move':
+                # MediaWiki 1.25+ has params, older versions move
+                details = logevent.get('params', logevent.get('move', {}))
+                target = details.get('target_title', details.get('new_title'))
+                if target:
+                    events.append((logevent['timestamp'], logevent['title'], 'move', target))
+            elif logevent.get('action') in ['delete', 'restore']:
+                events.append((logevent['timestamp'], logevent['title'], logevent['action'], None))
+
+    changes = foldChanges(events=events)
+    changes['until'] = until
+    print '    %d pages changed, %d moves, %d deletions' % (
+        len(changes['titles']), len(changes['moved']), len(changes['deleted']))
+    return changes
+
+
+def foldChanges(events=[]):
+    """ Fold the changes of the wiki, as (timestamp, title, event, target)
+        with event edit, move (to target), delete or restore, into the pages
+        to export, the edited, moved and restored ones that still exist
+        after the last of their changes, and the moves, deletions and
+        restores in the order they happened """
+    titles = []
+    seen = set()
+    exists = {}
+    moved = []
+    deleted = []
+    restored = []
+    for timestamp, title, event, target in sorted(events, key=lambda event: event[0]):
+        if event == 'move':
+            moved.append({'timestamp': timestamp, 'from': title, 'to': target})
+            exists[target] = True
+        elif event == 'delete':
+            deleted.append({'timestamp': timestamp, 'title': title})
+            exists[title] = False
+        else:
+            if event == 'restore':
+                restored.append({'timestamp': timestamp, 'title': title})
+            exists[title] = True
+        for name in [title, target]:
+            if name and name not in seen:
+                seen.add(name)
+                titles.append(name)
+    return {'titles': [title for title in titles if exists.get(title)],
+            'moved': moved, 'deleted': deleted, 'restored': restored}
+
+
+def saveDeltaManifest(config={}, changes={}):
+    """ Save the manifest linking an incremental dump to the one it continues """
+    manifestfilename = '%s-%s-delta.json' % (
+        domain2prefix(config=config), config['date'])
+    manifest = {
+        'base': config['incremental'],
+        'since': config['since'],
+        'until': changes['until'],
+        'titles': '%s-%s-titles.txt' % (domain2prefix(config=config), config['date']),
+        'xml': getXMLFileName(config=config),
+        'moved': changes['moved'],
+        'deleted': changes['deleted'],
+        'restored': changes['restored'],
+    }
+    with open('%s/%s' % (config['path'], manifestfilename), 'w') as outfile:
+        json.dump(manifest, outfile, indent=4, sort_keys=True)
+    print 'Changes saved at...', manifestfilename
+
+
+def getDeltaSince(path=''):
+    """ Return the timestamp from which the changes of the wiki are not in
+        the dump at path """
+    try:
+        with open('%s/config.txt' % (path), 'r') as infile:
+            baseconfig = cPickle.load(infile)
+    except:
+        print 'ERROR: There is no dump to continue in %s' % (path)
+        sys.exit(1)
+    # an incremental dump knows when its changes were listed
+    manifestfilename = '%s/%s-%s-delta.json' % (
+        path, domain2prefix(config=baseconfig), baseconfig['date'])
+    if os.path.isfile(manifestfilename):
+        with open(manifestfilename, 'r') as infile:
+            return json.load(infile)['until']
+    # a full dump only knows the (local) day it started: go back one day
+    date = datetime.datetime.strptime(baseconfig['date'], '%Y%m%d')
+    return (date - datetime.timedelta(days=1)).strftime('%Y-%m-%dT%H:%M:%SZ')
+
+
 def getPageTitles(config={}, session=None):
     """ Get list of page titles """
     # http://en.wikipedia.org/wiki/Special:AllPages
@@ -413,7 +925,12 @@ def getPageTitles(config={}, session=None):
     print 'Excluding titles from namespaces = %s' % (config['exnamespaces'] and ','.join([str(i) for i in config['exnamespaces']]) or 'None')
 
     titles = []
-    if 'api' in config and config['api']:
+    if config.get('since'):
+        # incremental dump: only the pages changed since the previous one
+        changes = getChangesAPI(config=config, session=session)
+        saveDeltaManifest(config=config, changes=changes)
+        titles = changes['titles']
+    elif 'api' in config and config['api']:
         try:
             titles = getPageTitlesAPI(config=config, session=session)
         except:
@@ -429,6 +946,9 @@ def getPageTitles(config={}, session=None):
     for title in titles:
         titlesfile.write(title.encode('utf-8') + "\n")
         c += 1
+        if c % 100 == 0:
+            # the export may be reading the titles already (--pipeline)
+            titlesfile.flush()
     # TODO: Sort to remove dupes? In CZ, Widget:AddThis appears two times:
     # main namespace and widget namespace.
     # We can use sort -u in UNIX, but is it worth it?
@@ -488,13 +1008,14 @@ def getXMLHeader(config={}, session=None):
             try:
                 if config['api']:
                     print "Trying the local name for the Special namespace instead"
-                    r = session.post(
-                    url=config['api'],
+                    r = apiRequest(
+                    config=config,
                     params={
                         'action': 'query',
                         'meta': 'siteinfo',
                         'siprop': 'namespaces',
                         'format': 'json'},
+                    session=session,
                     timeout=120
                     )
                     config['export'] = json.loads(r.text)['query']['namespaces']['-1']['*'] \
@@ -544,21 +1065,120 @@ def logerror(config={}, text=''):
             outfile.write(output.encode('utf-8'))
 
 
-def getXMLPageCore(headers={}, params={}, config={}, session=None):
-    """  """
-    # returns a XML containing params['limit'] revisions (or current only), ending in </mediawiki>
-    # if retrieving params['limit'] revisions fails, returns a current only version
-    # if all fail, returns the empty string
-    xml = ''
+class XMLChunkScanner(object):
+    """ Single-pass scanner for the output of Special:Export. Data can be
+        fed in pieces; the part of the <page> to keep is passed to write """
+
+    # every tag we care about is on its own line, and the text of revisions
+    # is escaped, so nothing here can match inside the wikitext
+    r_tags = re.compile(
+        r'(?P<sha1>^[ \t]*<sha1(?:>[^<\n]*</sha1>|/>)[ \t]*\n)'
+        r'|<(?P<close>/?)(?P<tag>page|revision|mediawiki)\b[^>]*>'
+        r'|<timestamp>(?P<timestamp>[^<]*)</timestamp>',
+        re.M)
+
+    def __init__(self, write=None, header=False, continuation=False, multipage=False):
+        # header: keep what comes before the <page> (<mediawiki>, <siteinfo>)
+        # continuation: keep only the <revision>s, indented as in the <page>
+        # multipage: keep every <page>, not only the first one
+        self.output_ = write
+        self.continuation = continuation
+        self.multipage = multipage
+        self.output = header and not continuation
+        self.inpage = False
+        self.inrevision = False
+        self.done = False
+        self.buffer = ''
+        self.pages = 0  # </page> found
+        self.revisions = 0  # <revision> found in the kept <page>s
+        self.lasttimestamp = None  # of the last <revision>
+        self.complete = False  # </mediawiki> found
+        self.written = 0  # length of the data kept
+        self.pageends = []  # self.written at every </page>
+
+    def write(self, data):
+        self.written += len(data)
+        self.output_(data)
+
+    def feed(self, data):
+        """ Scan a piece of XML, keeping the last incomplete line for later """
+        if self.buffer:
+            data = self.buffer + data
+        end = data.rfind('\n') + 1
+        self.scan(data, end)
+        self.buffer = data[end:]
+
+    def close(self):
+        """ Scan what remains after the last newline """
+        data = self.buffer
+        self.buffer = ''
+        self.scan(data, len(data))
+
+    def scan(self, data, end):
+        pos = 0  # data before pos has been written or skipped already
+        for m in self.r_tags.finditer(data, 0, end):
+            if m.group('sha1'):
+                # sha1s out of <revision> are invalid for the XML schema
+                if self.output and self.inpage and not self.inrevision:
+                    self.write(data[pos:m.start()])
+                    pos = m.end()
+            elif m.group('timestamp') is not None:
+                if self.inrevision and not self.done:
+                    self.lasttimestamp = m.group('timestamp')
+            elif m.group('tag') == 'revision':
+                if m.group('close'):
+                    self.inrevision = False
+                    continue
+                self.inrevision = True
+                if self.done:
+                    continue
+                self.revisions += 1
+                if self.continuation and not self.output:
+                    self.write('  ')
+                    pos = m.start()
+                    self.output = True
+            elif m.group('tag') == 'page':
+                if m.group('close'):
+                    self.inpage = False
+                    self.pages += 1
+                    if self.output and not self.done:
+                        # the indentation of </page> is kept, as split did
+                        self.write(data[pos:m.start()])
+                        self.output = False
+                    self.pageends.append(self.written)
+                    if not self.multipage:
+                        self.done = True
+                    pos = m.end()
+                    continue
+                self.inpage = True
+                if not self.output and not self.continuation and not self.done:
+                    # from the beginning of the line, with its indentation
+                    pos = data.rfind('\n', 0, m.start()) + 1
+                    self.output = True
+            elif m.group('tag') == 'mediawiki' and m.group('close'):
+                self.complete = True
+        if self.output and pos < end:
+            self.write(data[pos:end])
+
+
+def getXMLPageCore(headers={}, params={}, config={}, session=None, outfile=None, header=False, continuation=False, multipage=False):
+    """ Stream a Special:Export request to outfile, trimming it on the fly """
+    # writes params['limit'] revisions (or current only) and returns the
+    # XMLChunkScanner which read the XML, ending in </mediawiki>
+    # if retrieving params['limit'] revisions fails, writes a current only version
+    # if all fail, raises ExportAbortedError and writes nothing
+    scanner = None
     c = 0
     maxseconds = 100  # max seconds to wait in a single sleeping
     maxretries = config['retries']  # x retries and skip
-    increment = 20  # increment every retry
+    start = outfile.tell()
 
-    while not re.search(r'</mediawiki>', xml):
+    while not scanner or not scanner.complete:
+        # a failed attempt may have written something already
+        outfile.seek(start)
+        outfile.truncate()
         if c > 0 and c < maxretries:
-            wait = increment * c < maxseconds and increment * \
-                c or maxseconds  # incremental until maxseconds
+            wait = backoff(retry=c, maxseconds=maxseconds)
             print '    In attempt %d, XML for "%s" is wrong. Waiting %d seconds and reloading...' %(c, params['pages'], wait)
             time.sleep(wait)
             # reducing server load requesting smallest chunks (if curonly then
@@ -588,7 +1208,11 @@ def getXMLPageCore(headers={}, params={}, config={}, session=None):
                     headers=headers,
                     params=params,
                     config=config,
-                    session=session
+                    session=session,
+                    outfile=outfile,
+                    header=header,
+                    continuation=continuation,
+                    multipage=multipage
                 )
             else:
                 print '    Saving in the errors log, and skipping...'
@@ -597,27 +1221,59 @@ def getXMLPageCore(headers={}, params={}, config={}, session=None):
                     text=u'Error while retrieving the last revision of "%s". Skipping.' %
                     (params['pages']))
                 raise ExportAbortedError(config['index'])
-                return ''  # empty xml
         # FIXME HANDLE HTTP Errors HERE
+        scanner = XMLChunkScanner(
+            write=outfile.write,
+            header=header,
+            continuation=continuation,
+            multipage=multipage)
+        r = None
         try:
-            r = session.post(url=config['index'], params=params, headers=headers, timeout=10)
-            handleStatusCode(r)
-            xml = fixBOM(r)
-        except requests.exceptions.ConnectionError as e:
-            print '    Connection error: %s'%(str(e[0]))
-            xml = ''
+            if multipage:
+                # the titles of a batch may not fit in a URL
+                r = session.post(url=config['index'], data=params, headers=headers, timeout=10, stream=True)
+            else:
+                r = session.post(url=config['index'], params=params, headers=headers, timeout=10, stream=True)
+            if r.status_code == 429 or r.status_code >= 500:
+                # overloaded, retry later
+                print '    HTTP Error %d.' % (r.status_code)
+            else:
+                handleStatusCode(r)
+                # Special:Export is always UTF-8, copy the bytes as they come
+                bom = True
+                for data in r.iter_content(chunk_size=64 * 1024):
+                    if bom and data:
+                        if data.startswith(codecs.BOM_UTF8):
+                            data = data[len(codecs.BOM_UTF8):]
+                        bom = False
+                    scanner.feed(data)
+                scanner.close()
+        except (requests.exceptions.ConnectionError, requests.exceptions.ChunkedEncodingError) as e:
+            print '    Connection error: %s'%(str(e))
+        finally:
+            if r is not None:
+                r.close()
         c += 1
 
-    return xml
+    return scanner
 
 
 def getXMLPage(config={}, title='', verbose=True, session=None):
-    """ Get the full history (or current only) of a page """
+    """ Get the full history (or current only) of a page, with the XML headers """
+    # Only for small pages: the whole history is kept in memory
+    xml = io.BytesIO()
+    writeXMLPage(config=config, title=title, outfile=xml, header=True, verbose=verbose, session=session)
+    yield xml.getvalue().decode('utf-8')
+
+
+def writeXMLPage(config={}, title='', outfile=None, header=False, verbose=True, session=None, limit=1000):
+    """ Write the full history (or current only) of a page to outfile;
+        returns the number of revisions written and whether only the last
+        one could be exported instead of the full history """
 
     # if server errors occurs while retrieving the full page history, it may return [oldest OK versions] + last version, excluding middle revisions, so it would be partialy truncated
     # http://www.mediawiki.org/wiki/Manual_talk:Parameters_to_Special:Export#Parameters_no_longer_in_use.3F
 
-    limit = 1000
     truncated = False
     title_ = title
     title_ = re.sub(' ', '_', title_)
@@ -630,88 +1286,305 @@ def getXMLPage(config={}, title='', verbose=True, session=None):
         params['curonly'] = 1
         params['limit'] = 1
     else:
-        params['offset'] = '1'  # 1 always < 2000s
+        # 1 always < 2000s, incremental dumps start where the previous ended
+        params['offset'] = config.get('since') or '1'
         params['limit'] = limit
     # in other case, do not set params['templates']
     if 'templates' in config and config['templates']:
         params['templates'] = 1
 
-    xml = getXMLPageCore(params=params, config=config, session=session)
-    if xml == "":
-        raise ExportAbortedError(config['index'])
-    if not "</page>" in xml:
+    # the first chunk keeps the <mediawiki> and <siteinfo> headers only if
+    # asked, and loses the page-level sha1s
+    start = outfile.tell()
+    scanner = getXMLPageCore(params=params, config=config, session=session, outfile=outfile, header=header)
+    if not scanner.pages:
+        xml = ''
+        if header:
+            outfile.seek(start)
+            xml = outfile.read().decode('utf-8')
+        outfile.seek(start)
+        outfile.truncate()
         raise PageMissingError(params['title'], xml)
-    else:
-        # strip these sha1s sums which keep showing up in the export and
-        # which are invalid for the XML schema (they only apply to
-        # revisions)
-        xml = re.sub(r'\n\s*<sha1>\w+</sha1>\s*\n', r'\n', xml)
-        xml = re.sub(r'\n\s*<sha1/>\s*\n', r'\n', xml)
-
-    yield xml.split("</page>")[0]
 
     # if complete history, check if this page history has > limit edits, if so, retrieve all using offset if available
     # else, warning about Special:Export truncating large page histories
-    r_timestamp = r'<timestamp>([^<]+)</timestamp>'
-
-    numberofedits = 0
-    numberofedits += len(re.findall(r_timestamp, xml))
+    numberofedits = scanner.revisions
 
     # search for timestamps in xml to avoid analysing empty pages like
     # Special:Allpages and the random one
-    if not config['curonly'] and re.search(r_timestamp, xml):
+    if not config['curonly'] and scanner.lasttimestamp and \
+            config.get('splithistories') and config.get('workers', 1) > 1 and \
+            config.get('api') and scanner.revisions >= params['limit'] and \
+            not 'curonly' in params:
+        # a long history: the rest of it in parallel ranges of revisions
+        revisions = writeXMLRevisionRanges(
+            config=config, params=params, title=title,
+            since=scanner.lasttimestamp, outfile=outfile, session=session,
+            limit=limit)
+        if revisions is None:
+            print 'ATTENTION: This wiki does not allow some parameters in Special:Export, therefore pages with large histories may be truncated'
+            truncated = True
+        else:
+            numberofedits += revisions
+            params['offset'] = ''
+    if not config['curonly'] and scanner.lasttimestamp:
         while not truncated and params['offset']:  # next chunk
             # get the last timestamp from the acum XML
-            params['offset'] = re.findall(r_timestamp, xml)[-1]
-            try:
-                xml2 = getXMLPageCore(
-                    params=params, config=config, session=session)
-            except MemoryError:
-                print "The page's history exceeds our memory, halving limit."
-                params['limit'] = params['limit'] / 2
-                continue
+            params['offset'] = scanner.lasttimestamp
+            # only the <revision>s of the next chunks are written, to merge
+            # them with the previous chunk of this page history
+            chunkstart = outfile.tell()
+            scanner2 = getXMLPageCore(
+                params=params, config=config, session=session, outfile=outfile, continuation=True)
 
             # are there more edits in this next XML chunk or no <page></page>?
-            if re.findall(r_timestamp, xml2):
-                if re.findall(r_timestamp, xml2)[-1] == params['offset']:
+            if scanner2.lasttimestamp:
+                if scanner2.lasttimestamp == params['offset']:
                     # again the same XML, this wiki does not support params in
                     # Special:Export, offer complete XML up to X edits (usually
                     # 1000)
                     print 'ATTENTION: This wiki does not allow some parameters in Special:Export, therefore pages with large histories may be truncated'
+                    outfile.seek(chunkstart)
+                    outfile.truncate()
                     truncated = True
                     break
                 else:
-                    """    </namespaces>
-                      </siteinfo>
-                      <page>
-                        <title>Main Page</title>
-                        <id>15580374</id>
-                        <restrictions>edit=sysop:move=sysop</restrictions> (?)
-                        <revision>
-                          <id>418009832</id>
-                          <timestamp>2011-03-09T19:57:06Z</timestamp>
-                          <contributor>
-                    """
-                    # offset is OK in this wiki, merge with the previous chunk
-                    # of this page history and continue
-                    try:
-                        xml2 = xml2.split("</page>")[0]
-                        yield '  <revision>' + ('<revision>'.join(xml2.split('<revision>')[1:]))
-                    except MemoryError:
-                        print "The page's history exceeds our memory, halving limit."
-                        params['limit'] = params['limit'] / 2
-                        continue
-                    xml = xml2
-                    numberofedits += len(re.findall(r_timestamp, xml))
+                    # offset is OK in this wiki, continue
+                    scanner = scanner2
+                    numberofedits += scanner.revisions
             else:
                 params['offset'] = ''  # no more edits in this page history
-    yield "</page>\n"
+    outfile.write("</page>\n")
 
     if verbose:
         if (numberofedits == 1):
            print '    %s, 1 edit' % (title.strip())
         else:
            print '    %s, %d edits' % (title.strip(), numberofedits)
+    # getXMLPageCore falls back to the last revision when it can't do more
+    return numberofedits, not config['curonly'] and 'curonly' in params
+
+
+def getPageTimestamps(config={}, title='', since='', session=None):
+    """ Timestamps of the revisions of a page after since, oldest first """
+    params = {
+        'action': 'query',
+        'prop': 'revisions',
+        'titles': title,
+        'rvprop': 'timestamp',
+        'rvlimit': 'max',
+        'rvdir': 'newer',
+        'format': 'json'}
+    if since:
+        params['rvstart'] = since
+    timestamps = []
+    while True:
+        r = apiRequest(config=config, params=params, session=session)
+        result = getJSON(r)
+        delay(config=config, session=session)
+        if 'error' in result:
+            raise KeyError(result['error'].get('code', 'revisions'))
+        for page in result.get('query', {}).get('pages', {}).values():
+            timestamps += [revision['timestamp'] for revision in page.get('revisions', [])]
+        if 'continue' in result:
+            params.update(result['continue'])
+        elif 'query-continue' in result and 'revisions' in result['query-continue']:
+            params.update(result['query-continue']['revisions'])
+        else:
+            break
+    # rvstart is included, Special:Export offsets are not
+    return [timestamp for timestamp in timestamps if timestamp > since]
+
+
+def splitRevisions(timestamps=[], since='', size=1000):
+    """ Split the revisions after since, with these timestamps, into ranges
+        of about size revisions: a list of (offset, number of revisions)
+        for Special:Export """
+    ranges = []
+    start = 0
+    while start < len(timestamps):
+        end = min(start + size, len(timestamps))
+        # an offset can't separate revisions of the same second
+        while end < len(timestamps) and timestamps[end - 1] == timestamps[end]:
+            end += 1
+        ranges.append((since, end - start))
+        since = timestamps[end - 1]
+        start = end
+    return ranges
+
+
+def writeXMLRevisionRange(config={}, params={}, offset='', count=None, outfile=None, session=None):
+    """ Write the <revision>s of a page after offset to outfile, count of
+        them or, if None, up to the last one; returns how many were written,
+        or None if the wiki ignores the offset """
+    params = dict(params, offset=offset, limit=min(params['limit'], count or params['limit']))
+    revisions = 0
+    while count is None or revisions < count:
+        if count is not None:
+            params['limit'] = min(params['limit'], count - revisions)
+        scanner = getXMLPageCore(params=params, config=config, session=session, outfile=outfile, continuation=True)
+        if 'curonly' in params:
+            # the last revision would be in the middle of the history
+            raise ExportAbortedError(config['index'])
+        if not scanner.lasttimestamp:
+            break  # no more revisions
+        if scanner.lasttimestamp <= params['offset']:
+            return None
+        revisions += scanner.revisions
+        params['offset'] = scanner.lasttimestamp
+    return revisions
+
+
+def writeXMLRevisionRanges(config={}, params={}, title='', since='', outfile=None, session=None, limit=1000):
+    """ Write the <revision>s of a page after since to outfile, fetching
+        ranges of them in parallel; returns how many were written, or None
+        if the wiki ignores the offsets """
+    timestamps = getPageTimestamps(config=config, title=title, since=since, session=session)
+    ranges = splitRevisions(timestamps=timestamps, since=since, size=limit)
+    if not ranges:
+        ranges = [(since, None)]
+    # the revisions saved since the timestamps were listed go in the last
+    ranges[-1] = (ranges[-1][0], None)
+    print '    %s, fetching %d more edits in %d ranges' % (title.strip(), len(timestamps), len(ranges))
+
+    def fetch(item):
+        offset, count = item
+        rangefile = tempfile.SpooledTemporaryFile(max_size=1024 * 1024)
+        return rangefile, writeXMLRevisionRange(
+            config=config, params=params, offset=offset, count=count,
+            outfile=rangefile, session=session)
+
+    # every range is written in order once all the previous ones were
+    total = 0
+    for rangefile, revisions in orderedMap(function=fetch, items=ranges, workers=config['workers']):
+        if revisions is None or total is None:
+            total = None
+        else:
+            rangefile.seek(0)
+            shutil.copyfileobj(rangefile, outfile)
+            total += revisions
+        rangefile.close()
+    return total
+
+
+def getPageSizes(config={}, titles=[], session=None):
+    """ Length in bytes of the last revision of every page of titles, from
+        the API, as a dict of titles (missing pages are 0) """
+    r = apiRequest(
+        config=config,
+        params={
+            'action': 'query',
+            'prop': 'info',
+            'titles': '|'.join(titles),
+            'format': 'json'},
+        session=session)
+    query = getJSON(r).get('query', {})
+    # the API answers with the normalized titles
+    normalized = dict([(n['to'], n['from']) for n in query.get('normalized', [])])
+    sizes = {}
+    for page in query.get('pages', {}).values():
+        title = page.get('title', u'')
+        sizes[normalized.get(title, title).encode('utf-8')] = page.get('length', 0)
+    return sizes
+
+
+def readPageSizes(config={}, items=[], sizes={}, session=None):
+    """ Yield the (title, titlesoffset) items, saving the size of their pages
+        in sizes as they are read, 50 at a time """
+    for group in groupItems(items=items, size=50):
+        try:
+            sizes.update(getPageSizes(config=config, titles=[title for title, titlesoffset in group], session=session))
+        except (KeyError, ValueError):
+            pass  # no sizes, the titles go in their order
+        for item in group:
+            yield item
+
+
+def getXMLPages(config={}, titles=[], session=None):
+    """ Get the current version of several pages with one Special:Export request """
+    # returns a dict title -> <page> chunk (UTF-8, without </page>) for the
+    # pages found in the export; missing pages are not in the dict
+    try:
+        params = {'title': config['export'], 'action': 'submit'}
+    except KeyError:
+        params = {'title': 'Special:Export', 'action': 'submit'}
+    params['pages'] = '\n'.join([re.sub(' ', '_', title) for title in titles])
+    params['curonly'] = 1
+    params['limit'] = 1
+    if 'templates' in config and config['templates']:
+        params['templates'] = 1
+
+    pages = {}
+    xml = io.BytesIO()
+    try:
+        # same cleaning as getXMLPage does for a single page, one <page> at a time
+        scanner = getXMLPageCore(params=params, config=config, session=session, outfile=xml, multipage=True)
+    except ExportAbortedError:
+        return pages
+    xml = xml.getvalue()
+    start = 0
+    for end in scanner.pageends:
+        page = xml[start:end]
+        start = end
+        xmltitle = re.search(r'<title>([^<]+)</title>', page)
+        if xmltitle:
+            pages[undoHTMLEntities(text=xmltitle.group(1).decode('utf-8'))] = page
+    return pages
+
+
+def exportXMLPages(config={}, titles=[], session=None, outfile=None):
+    """ Export several pages, together if configured for that. Returns a list
+        of (title, file with its <page> or None, number of revisions,
+        status for the resume index) """
+    # Pages are written to outfile if given, else every page to its own
+    # temporary file, which is kept in memory only while it is small
+    pages = {}
+    if len(titles) > 1:
+        delay(config=config, session=session)
+        pages = getXMLPages(config=config, titles=titles, session=session)
+
+    results = []
+    for title in titles:
+        pagefile = outfile or tempfile.SpooledTemporaryFile(max_size=1024 * 1024)
+        page = pages.get(title.decode('utf-8'))
+        revisions = 0
+        status = 'done'
+        if page:
+            print '    %s, 1 edit' % (title.strip())
+            pagefile.write(page)
+            pagefile.write('</page>\n')
+            revisions = 1
+        else:
+            # missing from the batch (deleted, renamed or the request failed),
+            # try again alone to be sure
+            delay(config=config, session=session)
+            start = pagefile.tell()
+            try:
+                revisions, degraded = writeXMLPage(config=config, title=title, outfile=pagefile, session=session)
+                if degraded:
+                    status = 'degraded'  # only its last revision
+            except (PageMissingError, ExportAbortedError) as e:
+                # failed exports are tried again at the end of the dump
+                status = isinstance(e, PageMissingError) and 'missing' or 'failed'
+                pagefile.seek(start)
+                pagefile.truncate()
+                if pagefile is not outfile:
+                    pagefile.close()
+                pagefile = None
+        results.append((title, pagefile, revisions, status))
+    return results
+
+
+def groupItems(items=[], size=1):
+    """ Split an iterable into lists of at most size items """
+    group = []
+    for item in items:
+        group.append(item)
+        if len(group) >= size:
+            yield group
+            group = []
+    if group:
+        yield group
 
 
 def cleanXML(xml=''):
@@ -724,79 +1597,545 @@ def cleanXML(xml=''):
     return xml
 
 
-def generateXMLDump(config={}, titles=[], start=None, session=None):
-    """ Generates a XML dump for a list of titles or from revision IDs """
+# file name extension of the XML dump for every --compress format
+xmlcompressions = {'gzip': '.gz', 'bz2': '.bz2', 'xz': '.xz', 'zstd': '.zst'}
+
+
+def getXMLFileName(config={}, suffix=''):
+    """ File name of the XML dump, with the extension of its compression """
+    return '%s-%s-%s%s.xml%s' % (domain2prefix(config=config),
+                                 config['date'],
+                                 config['curonly'] and 'current' or 'history',
+                                 suffix,
+                                 xmlcompressions.get(config.get('compress'), ''))
+
+
+def newCompressor(compress=None):
+    """ Compressor object for a --compress format: every one it makes
+        writes an independent member (gzip), stream (bz2, xz) or frame
+        (zstd) of the file, ended by its flush() """
+    if compress == 'gzip':
+        return zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    elif compress == 'bz2':
+        return bz2.BZ2Compressor(9)
+    elif compress == 'xz':
+        return lzma.LZMACompressor()
+    elif compress == 'zstd':
+        return zstandard.ZstdCompressor(level=10).compressobj()
+    raise ValueError('Unknown compression: %s' % (compress))
+
+
+def newDecompressor(compress=None):
+    """ Decompressor object for a single member, stream or frame of a
+        --compress format """
+    if compress == 'gzip':
+        return zlib.decompressobj(16 + zlib.MAX_WBITS)
+    elif compress == 'bz2':
+        return bz2.BZ2Decompressor()
+    elif compress == 'xz':
+        return lzma.LZMADecompressor()
+    elif compress == 'zstd':
+        return zstandard.ZstdDecompressor().decompressobj()
+    raise ValueError('Unknown compression: %s' % (compress))
+
+
+def compressXML(data='', compress=None):
+    """ data as a member of its own of a file compressed with compress """
+    if not compress:
+        return data
+    compressor = newCompressor(compress=compress)
+    return compressor.compress(data) + compressor.flush()
+
+
+def isXMLDumpComplete(filename='', compress=None):
+    """ Whether the XML dump ends with the </mediawiki> footer """
+    if not compress:
+        for l in reverse_readline(filename):
+            if l:
+                return l == '</mediawiki>'
+        return False
+    # the footer is the last member, and compressing it gives the same
+    # bytes every time
+    footer = compressXML(data='</mediawiki>\n', compress=compress)
+    with open(filename, 'rb') as f:
+        f.seek(0, os.SEEK_END)
+        if f.tell() < len(footer):
+            return False
+        f.seek(-len(footer), os.SEEK_END)
+        return f.read() == footer
+
+
+def generateXMLDump(config={}, titles=[], start=None, session=None, resume=None, follow=None):
+    """ Generates a XML dump for a list of titles or from revision IDs;
+        follow tells if the titles list is still being written """
     # TODO: titles is now unused.
 
     header, config = getXMLHeader(config=config, session=session)
     footer = '</mediawiki>\n'  # new line at the end
-    xmlfilename = '%s-%s-%s.xml' % (domain2prefix(config=config),
-                                    config['date'],
-                                    config['curonly'] and 'current' or 'history')
+    xmlfilename = getXMLFileName(config=config)
     xmlfile = ''
-    lock = True
 
     if config['xmlrevisions']:
         print 'Retrieving the XML for every page from the beginning'
-        xmlfile = open('%s/%s' % (config['path'], xmlfilename), 'w')
-        xmlfile.write(header.encode('utf-8'))
+        # no resume index: these dumps always start from the beginning
+        xmlfile = XMLDumpWriter(
+            filename='%s/%s' % (config['path'], xmlfilename),
+            interval=config.get('fsyncinterval', 100),
+            header=header.encode('utf-8'),
+            compress=config.get('compress'),
+            index=False)
         try:
             r_timestamp = r'<timestamp>([^<]+)</timestamp>'
-            for xml in getXMLRevisions(config=config, session=session):
-                numrevs = len(re.findall(r_timestamp, xml))
+            for pieces in getXMLRevisions(config=config, session=session):
+                # pages built from the API JSON are written as they are
+                # serialized, a revision at a time
+                numrevs = 0
+                for xml in pieces:
+                    numrevs += len(re.findall(r_timestamp, xml))
+                    xml = cleanXML(xml=xml)
+                    xmlfile.write(xml.encode('utf-8'))
+                xmlfile.addPage()
                 # Due to how generators work, it's expected this may be less
                 print "%d more revisions exported" % numrevs
-                xml = cleanXML(xml=xml)
-                xmlfile.write(xml.encode('utf-8'))
         except AttributeError:
             print "This wikitools module version is not working"
             sys.exit()
     else:
-        print 'Retrieving the XML for every page from "%s"' % (start and start or 'start')
-        if start:
+        titlesoffset = 0
+        skipstart = False
+        if resume:
+            print 'Retrieving the XML for every page after "%s"' % (resume['title'])
+            titlesoffset = resume['titlesoffset']
+        elif start:
+            print 'Retrieving the XML for every page from "%s"' % (start)
             print "Removing the last chunk of past XML dump: it is probably incomplete."
-            for i in reverse_readline('%s/%s' % (config['path'], xmlfilename), truncate=True):
-                pass
+            truncateXMLDump('%s/%s' % (config['path'], xmlfilename))
+            # if the page "start" was complete, it is kept and not downloaded again
+            for l in reverse_readline('%s/%s' % (config['path'], xmlfilename)):
+                xmltitle = re.search(r'<title>([^<]+)</title>', l)
+                if xmltitle:
+                    skipstart = undoHTMLEntities(text=xmltitle.group(1)) == start
+                    break
         else:
             # requested complete xml dump
-            lock = False
-            xmlfile = open('%s/%s' % (config['path'], xmlfilename), 'w')
-            xmlfile.write(header.encode('utf-8'))
-            xmlfile.close()
-
-        xmlfile = open('%s/%s' % (config['path'], xmlfilename), 'a')
-        c = 1
-        for title in readTitles(config, start):
-            if not title.strip():
-                continue
-            if title == start:  # start downloading from start, included
-                lock = False
-            if lock:
-                continue
-            delay(config=config, session=session)
-            if c % 10 == 0:
-                print 'Downloaded %d pages' % (c)
-            try:
-                for xml in getXMLPage(config=config, title=title, session=session):
-                    xml = cleanXML(xml=xml)
-                    xmlfile.write(xml.encode('utf-8'))
-            except PageMissingError:
-                logerror(
+            print 'Retrieving the XML for every page from "start"'
+
+        # when resuming, everything after the last committed page is removed
+        xmlfile = XMLDumpWriter(
+            filename='%s/%s' % (config['path'], xmlfilename),
+            interval=config.get('fsyncinterval', 100),
+            resume=resume,
+            header=not resume and not start and header.encode('utf-8') or None,
+            compress=config.get('compress'))
+        # readTitles starts at the title "start" (included) or after the
+        # last indexed title when resuming; pages are fetched by
+        # config['workers'] threads but written here, one after another, in
+        # the order of the titles list
+        titles = (item for item in readTitles(config, start, offset=titlesoffset, positions=True, follow=follow) if item[0].strip())
+        if skipstart:
+            next(titles, None)
+        # with --curonly, Special:Export can send many pages in one request
+        batch = config['curonly'] and config.get('batch', 1) or 1
+        # a single worker streams pages straight into the dump, several
+        # workers (or batches, whose pages are recorded one at a time) each
+        # into temporary files copied here in order
+        workers = config.get('workers', 1)
+        # the largest pages start first, so none of them is left for the
+        # end, but they are still written in order
+        sizes = {}
+        priority = None
+        window = 0
+        if config.get('largestfirst') and workers > 1 and config.get('api'):
+            titles = readPageSizes(config=config, items=titles, sizes=sizes, session=session)
+            priority = lambda items: sum([sizes.pop(title, 0) for title, titlesoffset in items])
+            window = workers * 10
+        for items, results in orderedMap(
+                function=lambda items: (items, exportXMLPages(
                     config=config,
-                    text=u'The page "%s" was missing in the wiki (probably deleted)' %
-                    (title.decode('utf-8'))
-                )
-            # here, XML is a correct <page> </page> chunk or
-            # an empty string due to a deleted page (logged in errors log) or
-            # an empty string due to an error while retrieving the page from server
-            # (logged in errors log)
-            c += 1
-
+                    titles=[title for title, titlesoffset in items],
+                    session=session,
+                    outfile=workers == 1 and batch == 1 and xmlfile.xmlfile or None)),
+                items=groupItems(items=titles, size=batch),
+                workers=workers,
+                window=window,
+                priority=priority):
+            for (title, titlesoffset), (title, pagefile, revisions, status) in zip(items, results):
+                if (xmlfile.pages + 1) % 10 == 0:
+                    print 'Downloaded %d pages' % (xmlfile.pages + 1)
+                if status == 'failed':
+                    pass  # in the errors log already
+                elif pagefile is None:
+                    logerror(
+                        config=config,
+                        text=u'The page "%s" was missing in the wiki (probably deleted)' %
+                        (title.decode('utf-8'))
+                    )
+                elif pagefile is not xmlfile.xmlfile:
+                    pagefile.seek(0)
+                    shutil.copyfileobj(pagefile, xmlfile.xmlfile)
+                    pagefile.close()
+                # here, XML is a correct <page> </page> chunk or
+                # an empty string due to a deleted page (logged in errors log) or
+                # an empty string due to an error while retrieving the page from server
+                # (logged in errors log)
+                xmlfile.addPage(title=title, titlesoffset=titlesoffset, status=status, revisions=revisions)
+
+        xmlfile.commit()
+        # before the footer: a complete dump had its retry pass
+        retryXMLPages(config=config, header=header, session=session)
+
+    # the footer goes in a compressed member of its own
+    xmlfile.commit()
     xmlfile.write(footer)
     xmlfile.close()
     print 'XML dump saved at...', xmlfilename
 
+
+def retryXMLPages(config={}, header=u'', session=None):
+    """ Export again the pages whose export failed, or kept only their last
+        revision, during the dump; those that work now are saved in a
+        supplementary XML dump """
+    retries = [record for record in readXMLState(config=config)
+               if record['status'] in ['failed', 'degraded']]
+    if not retries:
+        return
+    xmlfilename = getXMLFileName(config=config, suffix='-retried')
+    print 'Retrying %d pages which could not be exported completely...' % (len(retries))
+    # created with the first page recovered: no empty dump otherwise
+    xmlfile = None
+    recovered = 0
+    for record in retries:
+        title = record['title']
+        pagefile = tempfile.SpooledTemporaryFile(max_size=1024 * 1024)
+        delay(config=config, session=session)
+        try:
+            # smaller requests, and waits from the start again
+            revisions, degraded = writeXMLPage(config=config, title=title, outfile=pagefile, session=session, limit=100)
+        except (PageMissingError, ExportAbortedError):
+            pagefile.close()
+            continue
+        if degraded and record['status'] == 'degraded':
+            # nothing new: the dump has its last revision already
+            pagefile.close()
+            continue
+        if xmlfile is None:
+            xmlfile = XMLDumpWriter(
+                filename='%s/%s' % (config['path'], xmlfilename),
+                interval=config.get('fsyncinterval', 100),
+                header=header.encode('utf-8'),
+                compress=config.get('compress'),
+                index=False)
+        pagefile.seek(0)
+        shutil.copyfileobj(pagefile, xmlfile)
+        pagefile.close()
+        xmlfile.addPage()
+        recovered += 1
+        logerror(
+            config=config,
+            text=u'The page "%s" was exported again in %s' % (title.decode('utf-8'), xmlfilename))
+    if xmlfile is None:
+        print 'None of the %d pages could be recovered' % (len(retries))
+        return
+    xmlfile.commit()
+    xmlfile.write('</mediawiki>\n')
+    xmlfile.close()
+    print '%d of %d pages recovered, saved at... %s' % (recovered, len(retries), xmlfilename)
+
+
+class XMLDumpWriter(object):
+    """ Appends <page>s to an XML dump and commits them every few pages:
+        the XML is synced to disk, then the resume index gets a record of
+        the state of every page (see parseXMLIndexRecord). A compressed dump gets a new
+        member (gzip), stream (bz2, xz) or frame (zstd) at every commit, so
+        it can be cut after any of them like the plain XML; like the
+        multistream dumps of Wikimedia, a block index tells in which one
+        every page is """
+
+    # the title and the id of a page come before its first <revision>, each
+    # on its own line
+    r_pageinfo = re.compile(r'^[ \t]*<(title|id)>([^<\n]*)</(?:title|id)>[ \t]*$', re.M)
+
+    def __init__(self, filename='', interval=100, resume=None, header=None, compress=None, index=True):
+        # resume: the record of readXMLIndex to roll back to
+        # header: start a new dump with this header
+        # compress: a format of newCompressor, or None for plain XML
+        self.filename = filename
+        self.indexfilename = '%s.idx' % (filename)
+        self.blockindexfilename = getXMLBlockIndexFileName(filename)
+        self.interval = max(1, interval)
+        self.compress = compress
+        self.compressor = None
+        self.index = index
+        self.records = []
+        self.pages = 0
+        self.pagestart = 0  # where the next plain page begins
+        self.blockstart = 0  # where the current member begins
+        self.blockpages = []  # (id, title) of the pages in it
+        self.pagetitle = None  # of the page whose id comes next
+        self.pagebuffer = ''  # last incomplete line of the page
+        if header is not None:
+            with open(self.filename, 'wb') as f:
+                f.write(compressXML(data=header, compress=compress))
+            for filename in [index and self.indexfilename, compress and self.blockindexfilename]:
+                if filename:
+                    with open(filename, 'wb') as f:
+                        pass
+        elif resume:
+            # the pages after the last record are probably incomplete
+            with open(self.filename, 'r+b') as f:
+                f.truncate(resume['xmloffset'])
+            with open(self.indexfilename, 'r+b') as f:
+                f.truncate(resume['indexoffset'])
+            if compress:
+                truncateXMLBlockIndex(self.blockindexfilename, resume['xmloffset'])
+            self.pages = resume['pages']
+        self.dumpfile = open(self.filename, 'ab')
+        self.dumpfile.seek(0, os.SEEK_END)
+        self.pagestart = self.dumpfile.tell()
+        # pages are written to xmlfile, which may be rewound while a page
+        # is downloaded: with compression, it only holds the last page
+        self.xmlfile = self.dumpfile
+        self.blockindexfile = None
+        if compress:
+            self.xmlfile = tempfile.SpooledTemporaryFile(max_size=16 * 1024 * 1024)
+            self.blockindexfile = open(self.blockindexfilename, 'ab')
+        self.indexfile = index and open(self.indexfilename, 'ab') or None
+
+    def write(self, data):
+        self.xmlfile.write(data)
+
+    def addPage(self, title='', titlesoffset=0, status='done', revisions=0):
+        """ The page of title (or nothing, if missing) was written """
+        self.pages += 1
+        # a compressed page is somewhere in its member, known at commit
+        start, offset = None, None
+        if self.compress:
+            self.compressPage()
+        else:
+            start, offset = self.pagestart, self.xmlfile.tell()
+            self.pagestart = offset
+        if self.index:
+            self.records.append([self.pages, offset, titlesoffset, status, revisions, start, title])
+        if self.pages % self.interval == 0:
+            self.commit()
+
+    def compressPage(self):
+        """ Compress what was written since the last page into the current
+            member of the dump """
+        if self.compressor is None:
+            self.compressor = newCompressor(compress=self.compress)
+            self.blockstart = self.dumpfile.tell()
+        self.xmlfile.seek(0)
+        for data in iter(lambda: self.xmlfile.read(1024 * 1024), ''):
+            self.indexBlockPages(data)
+            self.dumpfile.write(self.compressor.compress(data))
+        self.xmlfile.seek(0)
+        self.xmlfile.truncate()
+
+    def indexBlockPages(self, data):
+        """ Find the title and the id of the pages in a piece of XML """
+        data = self.pagebuffer + data
+        end = data.rfind('\n') + 1
+        for m in self.r_pageinfo.finditer(data, 0, end):
+            if m.group(1) == 'title':
+                self.pagetitle = undoHTMLEntities(text=m.group(2))
+            elif self.pagetitle is not None:
+                self.blockpages.append((m.group(2), self.pagetitle))
+                self.pagetitle = None
+        self.pagebuffer = data[end:]
+
+    def commit(self):
+        """ Make the pages written so far survive a crash """
+        if self.compress:
+            if self.xmlfile.tell():
+                self.compressPage()
+            if self.compressor is not None:
+                self.dumpfile.write(self.compressor.flush())
+                self.compressor = None
+        if not self.records and not self.blockpages:
+            return
+        # the XML must reach the disk first, or the index could point after
+        # its real end
+        self.dumpfile.flush()
+        os.fsync(self.dumpfile.fileno())
+        end = self.dumpfile.tell()
+        if self.blockpages:
+            # before the resume index, which must not get ahead of it
+            self.blockindexfile.write(''.join(['%d:%s:%s\n' % (self.blockstart, pageid, title)
+                                               for pageid, title in self.blockpages]))
+            self.blockindexfile.flush()
+            os.fsync(self.blockindexfile.fileno())
+            del self.blockpages[:]
+        if not self.records:
+            return
+        if self.compress:
+            # the pages of a member are all in [blockstart, end), and the
+            # dump can only be cut where a member ends
+            for record in self.records:
+                record[1], record[5] = -1, self.blockstart
+            self.records[-1][1] = end
+        self.indexfile.write(''.join(['%d\t%d\t%d\t%s\t%d\t%d\t%s\n' % tuple(record)
+                                      for record in self.records]))
+        self.indexfile.flush()
+        os.fsync(self.indexfile.fileno())
+        del self.records[:]
+
+    def close(self):
+        self.commit()
+        if self.xmlfile is not self.dumpfile:
+            self.xmlfile.close()
+        self.dumpfile.close()
+        for f in [self.indexfile, self.blockindexfile]:
+            if f:
+                f.close()
+
+
+def getXMLBlockIndexFileName(filename=''):
+    """ File name of the block index of a compressed XML dump """
+    return re.sub(r'\.xml(\.[a-z0-9]+)?$', '', filename) + '-index.txt'
+
+
+def truncateXMLBlockIndex(filename='', offset=0):
+    """ Remove the pages of the blocks from offset on from a block index """
+    size = 0
+    with open(filename, 'r+b') as f:
+        for line in f:
+            if int(line.split(':', 1)[0]) >= offset or not line.endswith('\n'):
+                break
+            size += len(line)
+        f.truncate(size)
+
+
+def readXMLBlock(filename='', offset=0, compress=None):
+    """ Decompress the block of a compressed XML dump starting at offset,
+        as found in its block index """
+    decompressor = newDecompressor(compress=compress)
+    xml = []
+    with open(filename, 'rb') as f:
+        f.seek(offset)
+        for data in iter(lambda: f.read(64 * 1024), ''):
+            try:
+                xml.append(decompressor.decompress(data))
+            except EOFError:
+                break  # the block ended with the previous data
+            if decompressor.unused_data or getattr(decompressor, 'eof', False):
+                break
+    return ''.join(xml)
+
+
+def truncateXMLDump(filename='', buf_size=8192):
+    """ Remove what follows the last </page> of an XML dump, reading it
+        backwards; returns the new size, or None if there is no </page> """
+    endtag = '</page>\n'
+    with open(filename, 'r+b') as fh:
+        fh.seek(0, os.SEEK_END)
+        end = fh.tell()
+        tail = ''
+        while end > 0:
+            start = max(0, end - buf_size)
+            fh.seek(start)
+            # keep the beginning of the previous block, the tag may be split
+            tail = fh.read(end - start) + tail[:len(endtag) - 1]
+            found = tail.rfind(endtag)
+            if found >= 0:
+                fh.truncate(start + found + len(endtag))
+                return start + found + len(endtag)
+            end = start
+    return None
+
+
+def parseXMLIndexRecord(line=''):
+    """ A record of the resume index as a dict: the number of pages up to
+        this one, where the dump can be cut after it (xmloffset, -1 if not
+        there), where its line in the titles list ends, its status (done,
+        missing in the wiki, failed or degraded to its last revision), its
+        revisions, where it begins in the XML (xmlstart, the
+        start of its block if compressed) and its title """
+    fields = line.split('\t', 6)
+    if len(fields) == 4:
+        # written by an older version
+        fields = fields[:3] + ['done', '0', '-1', fields[3]]
+    pages, xmloffset, titlesoffset, status, revisions, xmlstart, title = fields
+    return {
+        'pages': int(pages),
+        'xmloffset': int(xmloffset),
+        'titlesoffset': int(titlesoffset),
+        'status': status,
+        'revisions': int(revisions),
+        'xmlstart': int(xmlstart),
+        'title': title,
+    }
+
+
+def readXMLState(config={}):
+    """ Yield every record of the resume index of the XML dump, which is
+        the state of every page of the titles list dumped so far """
+    xmlfilename = getXMLFileName(config=config)
+    try:
+        indexfile = open('%s/%s.idx' % (config['path'], xmlfilename), 'rb')
+    except IOError:
+        return
+    with indexfile:
+        for line in indexfile:
+            if not line.endswith('\n'):
+                break  # the last record was not completely written
+            yield parseXMLIndexRecord(line[:-1])
+
+
+def readXMLIndex(config={}):
+    """ Return the last record of the resume index of the XML dump after
+        which it can be cut, as a dict, or None if there is no usable index """
+    xmlfilename = getXMLFileName(config=config)
+    try:
+        indexfile = open('%s/%s.idx' % (config['path'], xmlfilename), 'rb')
+    except IOError:
+        return None  # dump started by an older version, or --xmlrevisions
+    with indexfile:
+        # records are short, the last complete one is in the tail
+        indexfile.seek(0, os.SEEK_END)
+        size = indexfile.tell()
+        indexfile.seek(max(0, size - 64 * 1024))
+        tail = indexfile.read()
+    end = tail.rfind('\n') + 1
+    record = None
+    try:
+        while end and record is None:
+            start = tail.rfind('\n', 0, end - 1) + 1
+            if not start and len(tail) < size:
+                return None  # the record may be cut
+            record = parseXMLIndexRecord(tail[start:end - 1])
+            # the records after it are from a commit that did not end
+            record['indexoffset'] = size - len(tail) + end
+            if record['xmloffset'] < 0:
+                record = None
+            end = start
+    except ValueError:
+        return None
+    if record is None:
+        return None
+    title = record['title']
+
+    # titles.txt may have been reloaded since: check the offset is still
+    # right after the line of that title
+    line = '\n%s\n' % (title)
+    try:
+        if os.path.getsize('%s/%s' % (config['path'], xmlfilename)) < record['xmloffset']:
+            return None
+        titlesfile = open('%s/%s-%s-titles.txt' % (config['path'], domain2prefix(config=config), config['date']), 'rb')
+        with titlesfile:
+            titlesfile.seek(max(0, record['titlesoffset'] - len(line)))
+            found = titlesfile.read(min(len(line), record['titlesoffset']))
+    except (IOError, OSError):
+        return None
+    # the first title of the list has no newline before it
+    if found != line and found != line[1:]:
+        return None
+    return record
+
+
 def getXMLRevisions(config={}, session=None, allpages=False):
+    """ Yield the XML of every page from the API, as a list or iterator of
+        the pieces of it """
     site = wikitools.wiki.Wiki(config['api'])
     if not 'all' in config['namespaces']:
         namespaces = config['namespaces']
@@ -812,51 +2151,37 @@ def getXMLRevisions(config={}, session=None, allpages=False):
                 'arvlimit': 500,
                 'arvnamespace': namespace
             }
+            if config.get('since'):
+                arvparams['arvstart'] = config['since']
+                arvparams['arvdir'] = 'newer'
             if not config['curonly']:
                 # We have to build the XML manually...
-                # Skip flags, presumably needed to add <minor/> which is in the schema.
-                # Also missing: parentid and contentformat.
-                arvparams['arvprop'] = 'ids|timestamp|user|userid|size|sha1|contentmodel|comment|content'
+                arvparams['arvprop'] = 'ids|flags|timestamp|user|userid|size|sha1|contentmodel|comment|content'
                 arvrequest = wikitools.api.APIRequest(site, arvparams)
                 results = arvrequest.queryGen()
                 for result in results:
                     for page in result['query']['allrevisions']:
-                        yield makeXmlFromPage(page)
+                        yield makeXmlPieces(page)
             else:
                 # Just cycle through revision IDs and use the XML as is
                 arvparams['arvprop'] = 'ids'
-                arvrequest = wikitools.api.APIRequest(site, arvparams)
-                arvresults = arvrequest.queryGen()
-                for result in arvresults:
-                    revids = []
-                    for page in result['query']['allrevisions']:
-                        for revision in page['revisions']:
-                            revids.append(str(revision['revid']))
-                    print "%d more revisions listed, until %s" % (len(revids), revids[-1])
-
-                    exportparams = {
-                        'action': 'query',
-                        'revids': '|'.join(revids),
-                        'export': '1',
-                    }
-                    exportrequest = wikitools.api.APIRequest(site, exportparams)
-                    exportresults = exportrequest.queryGen()
-                    for exportresult in exportresults:
-                        yield exportresult['query']['export']['*']
+                revisions = getAPIList(config=config, params=arvparams, session=session)
+                # the next revision IDs are listed while config['workers']
+                # threads export the previous ones, yielded in listing order;
+                # all the requests go through the session and its pace
+                for exports in orderedMap(
+                        function=lambda revids: exportRevisionIDs(config=config, revids=revids, session=session),
+                        items=listRevisionIDs(revisions=revisions),
+                        workers=config.get('workers', 1)):
+                    for export in exports:
+                        yield [export]
 
     except KeyError:
         print "Warning. Could not use allrevisions, wiki too old."
         if config['curonly']:
-            for title in readTitles(config):
-                exportparams = {
-                    'action': 'query',
-                    'titles': title,
-                    'export': '1',
-                }
-                exportrequest = wikitools.api.APIRequest(site, exportparams)
-                exportresults = exportrequest.queryGen()
-                for exportresult in exportresults:
-                    yield exportresult['query']['export']['*']
+            # the last revisions of many pages in every request
+            for xml in getXMLCurrentRevisions(config=config, namespaces=namespaces, session=session):
+                yield xml
         else:
             for title in readTitles(config):
                 pparams = {
@@ -864,9 +2189,12 @@ def getXMLRevisions(config={}, session=None, allpages=False):
                     'titles': title,
                     'prop': 'revisions',
                     'rvlimit': 'max',
-                    'rvprop': 'ids|timestamp|user|userid|size|sha1|contentmodel|comment|content',
+                    'rvprop': 'ids|flags|timestamp|user|userid|size|sha1|contentmodel|comment|content',
                     'rawcontinue': 'yes'
                 }
+                if config.get('since'):
+                    pparams['rvstart'] = config['since']
+                    pparams['rvdir'] = 'newer'
                 prequest = wikitools.api.APIRequest(site, pparams)
                 try:
                     results = prequest.query()
@@ -875,7 +2203,7 @@ def getXMLRevisions(config={}, session=None, allpages=False):
                     raise PageMissingError(title, xml='')
                 for page in pages:
                     try:
-                        xml = makeXmlFromPage(pages[page])
+                        xml = makeXmlPieces(pages[page])
                     except PageMissingError:
                         logerror(
                             config=config,
@@ -888,64 +2216,225 @@ def getXMLRevisions(config={}, session=None, allpages=False):
         print "This wikitools version seems not to work for us. Exiting."
         sys.exit()
 
+def getXMLCurrentRevisions(config={}, namespaces=[], session=None):
+    """ Yield the XML of the last revision of every page of namespaces from
+        the API, as a list of the pieces of it, for 50 pages per request (500
+        for bots), following the continuation of both old and new API
+        versions """
+    limit = 50
+    r = apiRequest(
+        config=config,
+        params={
+            'action': 'query',
+            'meta': 'userinfo',
+            'uiprop': 'rights',
+            'format': 'json'},
+        session=session)
+    if 'apihighlimits' in getJSON(r).get('query', {}).get('userinfo', {}).get('rights', []):
+        limit = 500
+
+    for namespace in namespaces:
+        if namespace in config['exnamespaces']:
+            print '    Skipping namespace = %d' % (namespace)
+            continue
+        print "Exporting the last revisions of namespace %s, %d pages per request" % (namespace, limit)
+        params = {
+            'action': 'query',
+            'generator': 'allpages',
+            'gapnamespace': namespace,
+            'gaplimit': limit,
+            'prop': 'revisions',
+            'rvprop': 'ids|flags|timestamp|user|userid|size|sha1|contentmodel|comment|content',
+            'format': 'json',
+        }
+        request = params
+        while True:
+            r = apiRequest(config=config, params=request, session=session)
+            result = getJSON(r)
+            delay(config=config, session=session)
+            if 'error' in result:
+                raise KeyError(result['error'].get('code', 'allpages'))
+            pages = result.get('query', {}).get('pages', {}).values()
+            for page in sorted(pages, key=lambda page: page.get('title')):
+                if not 'revisions' in page:
+                    continue  # too much content, it comes in the next result
+                if config.get('since') and page['revisions'][0].get('timestamp', '') < config['since']:
+                    continue
+                try:
+                    yield makeXmlPieces(page)
+                except PageMissingError:
+                    logerror(
+                        config=config,
+                        text=u'Error: empty revision from API. Could not export page: %s' % (page.get('title', u''))
+                    )
+            if 'continue' in result:
+                # into the original request: an rvcontinue of the previous
+                # pages would not be valid for the next ones
+                request = dict(params, **result['continue'])
+            elif 'query-continue' in result:
+                # before MediaWiki 1.21: the content of the same pages
+                # first, then the next pages
+                querycontinue = result['query-continue']
+                if 'revisions' in querycontinue:
+                    request = dict(request, **querycontinue['revisions'])
+                elif 'allpages' in querycontinue:
+                    request = dict(params, **querycontinue['allpages'])
+                else:
+                    break
+            else:
+                break
+
+
+def listRevisionIDs(revisions=[], size=50):
+    """ Yield lists of up to size revision IDs of the pages listed by
+        allrevisions; the API exports 50 of them per request (500 for bots) """
+    revids = []
+    for page in revisions:
+        for revision in page['revisions']:
+            revids.append(str(revision['revid']))
+            if len(revids) >= size:
+                print "%d more revisions listed, until %s" % (len(revids), revids[-1])
+                yield revids
+                revids = []
+    if revids:
+        print "%d more revisions listed, until %s" % (len(revids), revids[-1])
+        yield revids
+
+
+def exportRevisionIDs(config={}, revids=[], session=None):
+    """ Return the XML exports of the revision IDs by the API """
+    r = apiRequest(
+        config=config,
+        params={
+            'action': 'query',
+            'revids': '|'.join(revids),
+            'export': '1',
+            'format': 'json'},
+        session=session)
+    result = getJSON(r)
+    delay(config=config, session=session)
+    return [result['query']['export']['*']]
+
+
 def makeXmlFromPage(page):
     """ Output an XML document as a string from a page as in the API JSON """
+    return ''.join(makeXmlPieces(page))
+
+
+def makeXmlPieces(page):
+    """ Return an iterator over the XML of a page as in the API JSON, one
+        piece for every revision, so the page is never whole in memory """
     try:
-        p = E.page(
-                E.title(page['title']),
-                E.ns(to_unicode(page['ns'])),
-                E.id(to_unicode(page['pageid'])),
-        )
+        page['title'], page['ns'], page['pageid']
         for rev in page['revisions']:
-            revision = E.revision(
-                E.id(to_unicode(rev['revid'])),
-                E.parentid(to_unicode(rev['parentid'])),
-                E.timestamp(rev['timestamp']),
-                E.contributor(
-                        E.id(to_unicode(rev['userid'])),
-                        E.username(to_unicode(rev['user'])),
-                ),
-                E.comment(rev['comment']),
-                E.text(rev['*'], space="preserve", bytes=to_unicode(rev['size'])),
-            )
-            if 'contentmodel' in rev:
-                revision.append(E.model(rev['contentmodel']))
-            # The sha1 may not have been backfilled on older wikis or lack for other reasons (Wikia).
-            if 'sha1' in rev:
-                revision.append(E.sha1(rev['sha1']))
-            p.append(revision)
+            rev['revid'], rev['timestamp']
     except KeyError:
-        raise PageMissingError(page['title'], '')
-    return etree.tostring(p, pretty_print=True)
+        raise PageMissingError(page.get('title', ''), '')
+    return _makeXmlPieces(page)
+
+
+def _makeXmlPieces(page):
+    """ Serialize a page as Special:Export does, in the order of the schema """
+    def text(value):
+        return escape(u'%s' % (value), {'"': '&quot;'})
+
+    yield u'  <page>\n    <title>%s</title>\n    <ns>%s</ns>\n    <id>%s</id>\n' % (
+        text(page['title']), text(page['ns']), text(page['pageid']))
+    for rev in page['revisions']:
+        xml = [u'    <revision>\n      <id>%s</id>\n' % (text(rev['revid']))]
+        if rev.get('parentid'):
+            xml.append(u'      <parentid>%s</parentid>\n' % (text(rev['parentid'])))
+        xml.append(u'      <timestamp>%s</timestamp>\n' % (text(rev['timestamp'])))
+        if 'userhidden' in rev:
+            xml.append(u'      <contributor deleted="deleted" />\n')
+        elif 'anon' in rev:
+            xml.append(u'      <contributor>\n        <ip>%s</ip>\n      </contributor>\n' % (text(rev.get('user', ''))))
+        elif rev.get('userid'):
+            xml.append(u'      <contributor>\n        <username>%s</username>\n        <id>%s</id>\n      </contributor>\n' % (
+                text(rev.get('user', '')), text(rev['userid'])))
+        else:
+            # no userid before MediaWiki 1.17, and 0 for imported edits
+            xml.append(u'      <contributor>\n        <username>%s</username>\n      </contributor>\n' % (
+                text(rev.get('user', ''))))
+        if 'minor' in rev:
+            xml.append(u'      <minor />\n')
+        if 'commenthidden' in rev:
+            xml.append(u'      <comment deleted="deleted" />\n')
+        elif rev.get('comment'):
+            xml.append(u'      <comment>%s</comment>\n' % (text(rev['comment'])))
+        if 'contentmodel' in rev:
+            xml.append(u'      <model>%s</model>\n' % (text(rev['contentmodel'])))
+        if 'contentformat' in rev:
+            xml.append(u'      <format>%s</format>\n' % (text(rev['contentformat'])))
+        if 'texthidden' in rev or '*' not in rev:
+            xml.append(u'      <text deleted="deleted" />\n')
+        else:
+            xml.append(u'      <text xml:space="preserve" bytes="%s">%s</text>\n' % (
+                text(rev.get('size', len(rev['*'].encode('utf-8')))), text(rev['*'])))
+        # The sha1 may not have been backfilled on older wikis or lack for other reasons (Wikia).
+        if rev.get('sha1'):
+            xml.append(u'      <sha1>%s</sha1>\n' % (text(rev['sha1'])))
+        else:
+            xml.append(u'      <sha1 />\n')
+        xml.append(u'    </revision>\n')
+        yield u''.join(xml)
+    yield u'  </page>\n'
+
 
-def readTitles(config={}, start=None):
-    """ Read title list from a file, from the title "start" """
+def readTitles(config={}, start=None, offset=0, positions=False, follow=None):
+    """ Read title list from a file, from the title "start" or the byte offset;
+        with positions, yield (title, offset of the next title). With follow,
+        a function telling if the list is still being written, wait for the
+        titles still to come until --END-- """
 
     titlesfilename = '%s-%s-titles.txt' % (
         domain2prefix(config=config), config['date'])
+    while follow and follow() and not os.path.exists('%s/%s' % (config['path'], titlesfilename)):
+        time.sleep(1)
     titlesfile = open('%s/%s' % (config['path'], titlesfilename), 'r')
 
     seeking = False
     if start:
         seeking = True
 
+    titlesfile.seek(offset)
     with titlesfile as f:
-        for line in f:
+        # readline, unlike iterating the file, keeps tell() right
+        while True:
+            position = f.tell()
+            line = f.readline()
+            if not line.endswith('\n') and follow:
+                f.seek(position)
+                if follow():
+                    # wait for the rest of the list
+                    time.sleep(1)
+                    continue
+                # the list may have been finished after the line was read:
+                # what is there now is all there will be
+                line = f.readline()
+                if not line.endswith('\n') and line.strip() != '--END--':
+                    line = ''
+            if not line:
+                if follow:
+                    print 'Error: the list of titles could not be completed. Please, resume the dump later.'
+                    sys.exit(1)
+                break
             if line.strip() == '--END--':
                 break
             elif seeking and line.strip() != start:
                 continue
             elif seeking and line.strip() == start:
                 seeking = False
-                yield line.strip()
+                yield positions and (line.strip(), f.tell()) or line.strip()
             else:
-                yield line.strip()
+                yield positions and (line.strip(), f.tell()) or line.strip()
 
-def reverse_readline(filename, buf_size=8192, truncate=False):
+def reverse_readline(filename, buf_size=8192):
     """a generator that returns the lines of a file in reverse order"""
     # Original code by srohde, abdus_salam: cc by-sa 3.0
     # http://stackoverflow.com/a/23646049/718903
-    with open(filename, 'r+') as fh:
+    # To remove an incomplete last page from a dump, use truncateXMLDump
+    with open(filename, 'rb') as fh:
         segment = None
         offset = 0
         fh.seek(0, os.SEEK_END)
@@ -962,30 +2451,18 @@ def reverse_readline(filename, buf_size=8192, truncate=False):
             if segment is not None:
                 # if the previous chunk starts right from the beginning of line
                 # do not concat the segment to the last line of new chunk
-                # instead, yield the segment first 
-                if buffer[-1] is not '\n':
+                # instead, yield the segment first
+                if buffer[-1] != '\n':
                     lines[-1] += segment
                 else:
-                    if truncate and '</page>' in segment:
-                        pages = buffer.split('</page>')
-                        fh.seek(-offset+buf_size-len(pages[-1]), os.SEEK_END)
-                        fh.truncate
-                        raise StopIteration
-                    else:
-                        yield segment
+                    yield segment
             segment = lines[0]
             for index in range(len(lines) - 1, 0, -1):
-                if truncate and '</page>' in segment:
-                    pages = buffer.split('</page>')
-                    fh.seek(-offset-len(pages[-1]), os.SEEK_END)
-                    fh.truncate
-                    raise StopIteration
-                else:
-                    yield lines[index]
+                yield lines[index]
         yield segment
 
 def saveImageNames(config={}, images=[], session=None):
-    """ Save image list in a file, including filename, url and uploader """
+    """ Save image list in a file, including filename, url, uploader, size and sha1 """
 
     imagesfilename = '%s-%s-images.txt' % (
         domain2prefix(config=config), config['date'])
@@ -993,12 +2470,16 @@ def saveImageNames(config={}, images=[], session=None):
     imagesfile.write(
         ('\n'.join(
             [
-                '%s\t%s\t%s' %
+                '%s\t%s\t%s\t%s\t%s' %
                 (filename,
                  url,
-                 uploader) for filename,
+                 uploader,
+                 size,
+                 sha1) for filename,
                 url,
-                uploader in images]
+                uploader,
+                size,
+                sha1 in images]
             ).encode('utf-8')
          )
     )
@@ -1120,7 +2601,8 @@ def getImageNamesScraper(config={}, session=None):
             uploader = re.sub('_', ' ', i.group('uploader'))
             uploader = undoHTMLEntities(text=uploader)
             uploader = urllib.unquote(uploader)
-            images.append([filename, url, uploader])
+            # size and sha1 are unknown without the API
+            images.append([filename, url, uploader, u'', u''])
             # print filename, url
 
         if re.search(r_next, raw):
@@ -1144,7 +2626,7 @@ def getImageNamesScraper(config={}, session=None):
 
 
 def getImageNamesAPI(config={}, session=None):
-    """ Retrieve file list: filename, url, uploader """
+    """ Retrieve file list: filename, url, uploader, size, sha1 """
     oldAPI = False
     aifrom = '!'
     images = []
@@ -1153,13 +2635,11 @@ def getImageNamesAPI(config={}, session=None):
         params = {
             'action': 'query',
             'list': 'allimages',
-            'aiprop': 'url|user',
+            'aiprop': 'url|user|size|sha1',
             'aifrom': aifrom,
             'format': 'json',
             'ailimit': 500}
-        # FIXME Handle HTTP Errors HERE
-        r = session.post(url=config['api'], params=params, timeout=30)
-        handleStatusCode(r)
+        r = apiRequest(config=config, params=params, session=session)
         jsonimages = getJSON(r)
         delay(config=config, session=session)
 
@@ -1191,7 +2671,9 @@ def getImageNamesAPI(config={}, session=None):
                 else:
                     filename = unicode(urllib.unquote((re.sub('_', ' ', url.split('/')[-1])).encode('ascii', 'ignore')), 'utf-8')
                 uploader = re.sub('_', ' ', image['user'])
-                images.append([filename, url, uploader])
+                size = u'%s' % (image.get('size', u''))
+                sha1 = image.get('sha1', u'')
+                images.append([filename, url, uploader, size, sha1])
         else:
             oldAPI = True
             break
@@ -1213,11 +2695,9 @@ def getImageNamesAPI(config={}, session=None):
                 'gaplimit': 500,
                 'gapfrom': gapfrom,
                 'prop': 'imageinfo',
-                'iiprop': 'user|url',
+                'iiprop': 'user|url|size|sha1',
                 'format': 'json'}
-            # FIXME Handle HTTP Errors HERE
-            r = session.post(url=config['api'], params=params, timeout=30)
-            handleStatusCode(r)
+            r = apiRequest(config=config, params=params, session=session)
             jsonimages = getJSON(r)
             delay(config=config, session=session)
 
@@ -1239,7 +2719,9 @@ def getImageNamesAPI(config={}, session=None):
 
                     filename = re.sub('_', ' ', tmp_filename)
                     uploader = re.sub('_', ' ', props['imageinfo'][0]['user'])
-                    images.append([filename, url, uploader])
+                    size = u'%s' % (props['imageinfo'][0].get('size', u''))
+                    sha1 = props['imageinfo'][0].get('sha1', u'')
+                    images.append([filename, url, uploader, size, sha1])
             else:
                 # if the API doesn't return query data, then we're done
                 break
@@ -1276,18 +2758,40 @@ def generateImageDump(config={}, other={}, images=[], start='', session=None):
         print 'Creating "%s" directory' % (imagepath)
         os.makedirs(imagepath)
 
+    # files and descriptions are downloaded by two pools of
+    # config['workers'] threads each, sharing the connections of session
+    # and the limit of connections per host
+    workers = config.get('workers', 1)
+    files, descs = itertools.tee(imageFilenames(other=other, images=images, start=start))
+    files = orderedMap(
+        function=lambda image: saveImageFile(config=config, imagepath=imagepath, image=image, session=session),
+        items=files,
+        workers=workers)
+    descs = orderedMap(
+        function=lambda image: saveImageDesc(config=config, imagepath=imagepath, image=image, session=session),
+        items=descs,
+        workers=workers)
     c = 0
+    for filename2, desc in itertools.izip(files, descs):
+        c += 1
+        if c % 10 == 0:
+            print '    Downloaded %d images' % (c)
+
+    print 'Downloaded %d images' % (c)
+
+
+def imageFilenames(other={}, images=[], start=''):
+    """ Yield (filename, local filename, url, size, sha1) for the images from
+        start (included) """
     lock = True
     if not start:
         lock = False
-    for filename, url, uploader in images:
+    for filename, url, uploader, size, sha1 in images:
         if filename == start:  # start downloading from start (included)
             lock = False
         if lock:
             continue
-        delay(config=config, session=session)
 
-        # saving file
         # truncate filename if length > 100 (100 + 32 (md5) = 132 < 143 (crash
         # limit). Later .desc is added to filename, so better 100 as max)
         filename2 = urllib.unquote(filename)
@@ -1295,12 +2799,119 @@ def generateImageDump(config={}, other={}, images=[], start='', session=None):
             # split last . (extension) and then merge
             filename2 = truncateFilename(other=other, filename=filename2)
             print 'Filename is too long, truncating. Now it is:', filename2
-        filename3 = u'%s/%s' % (imagepath, filename2)
-        imagefile = open(filename3, 'wb')
-        r = requests.get(url=url)
-        imagefile.write(r.content)
-        imagefile.close()
-        # saving description if any
+        yield filename, filename2, url, size, sha1
+
+
+def hostSlot(config={}, url=''):
+    """ Return the semaphore limiting the connections to the host of url """
+    host = urlparse(url).netloc
+    with hostslotslock:
+        if host not in hostslots:
+            hostslots[host] = threading.BoundedSemaphore(
+                config.get('hostconnections') or config.get('workers', 1))
+        return hostslots[host]
+
+hostslots = {}
+hostslotslock = threading.Lock()
+
+
+def saveImageFile(config={}, imagepath='', image=(), session=None):
+    """ Save a file of the image dump """
+    filename, filename2, url, size, sha1 = image
+    filename3 = u'%s/%s' % (imagepath, filename2)
+    if isImageSaved(filename=filename3, size=size, sha1=sha1):
+        # unchanged since a previous download, nothing to transfer
+        return filename2
+    delay(config=config, session=session)
+    # the file is streamed to a .part file and renamed once it is complete,
+    # so an interrupted download never looks like a saved file on resume
+    filename4 = u'%s.part' % (filename3)
+    maxretries = config.get('retries', 5)
+    for retry in range(maxretries + 1):
+        if retry:
+            wait = backoff(retry=retry)
+            print '    Download of "%s" failed, waiting %d seconds and retrying...' % (filename2, wait)
+            time.sleep(wait)
+        status = None
+        try:
+            with hostSlot(config=config, url=url):
+                status, saved = saveImageStream(session=session, url=url, filename=filename4)
+        except requests.exceptions.RequestException as e:
+            # also timeouts
+            print '    Connection error: %s' % (str(e))
+            continue
+        if 400 <= status < 500 and status != 429:
+            break  # missing or forbidden, retrying does not change it
+        if saved is None:
+            continue  # 429, 5xx or cut
+        if (size or sha1) and not isImageSaved(filename=filename4, size=size, sha1=sha1):
+            # complete, but not the file listed: kept, as it is all there is
+            print '    "%s" does not have the size or sha1 listed by the wiki' % (filename2)
+            logerror(
+                config=config,
+                text=u'The file "%s" downloaded from %s does not have the size or sha1 listed by the wiki' % (filename2, url))
+        if os.path.exists(filename3):
+            os.remove(filename3)  # os.rename does not replace it on Windows
+        os.rename(filename4, filename3)
+        return filename2
+
+    if os.path.exists(filename4):
+        os.remove(filename4)
+    logerror(
+        config=config,
+        text=u'The file "%s" could not be downloaded from %s%s' % (
+            filename2, url, status and status != 200 and u' (HTTP %d)' % (status) or u''))
+    return filename2
+
+
+def isImageSaved(filename='', size='', sha1=''):
+    """ Return True if filename exists with the size and sha1 listed by the
+        wiki. Files with neither of them known are never taken as saved """
+    if not (size or sha1) or not os.path.isfile(filename):
+        return False
+    if size and os.path.getsize(filename) != int(size):
+        return False
+    if sha1:
+        h = hashlib.sha1()
+        with open(filename, 'rb') as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), ''):
+                h.update(chunk)
+        if h.hexdigest() != sha1.lower():
+            return False
+    return True
+
+
+def saveImageStream(session=None, url='', filename='', timeout=60):
+    """ Stream url to filename in chunks. Return the HTTP status and the
+        number of bytes saved, None if the response was an error or was not
+        complete """
+    # the timeout is for every read, not for the whole file
+    r = session.get(url=url, stream=True, timeout=timeout)
+    try:
+        if r.status_code != 200:
+            print '    HTTP error %d' % (r.status_code)
+            return r.status_code, None
+        size = 0
+        with open(filename, 'wb') as imagefile:
+            for chunk in r.iter_content(1024 * 1024):
+                imagefile.write(chunk)
+                size += len(chunk)
+        # with a Content-Encoding the length is not the one of the saved data
+        length = r.headers.get('content-length')
+        if length and not r.headers.get('content-encoding') and int(length) != size:
+            print '    Expected %s bytes but received %d' % (length, size)
+            return r.status_code, None
+        return r.status_code, size
+    finally:
+        r.close()
+
+
+def saveImageDesc(config={}, imagepath='', image=(), session=None):
+    """ Save the XML of the description page of a file of the image dump """
+    filename, filename2, url, size, sha1 = image
+    delay(config=config, session=session)
+    # saving description if any
+    with hostSlot(config=config, url=config['index'] or config['api']):
         try:
             title = u'Image:%s' % (filename)
             if config['xmlrevisions'] and config['api'] and config['api'].endswith("api.php"):
@@ -1318,19 +2929,14 @@ def generateImageDump(config={}, other={}, images=[], start='', session=None):
                 text=u'The page "%s" was missing in the wiki (probably deleted)' % (title.decode('utf-8'))
             )
 
-        f = open('%s/%s.desc' % (imagepath, filename2), 'w')
-        # <text xml:space="preserve" bytes="36">Banner featuring SG1, SGA, SGU teams</text>
-        if not re.search(r'</mediawiki>', xmlfiledesc):
-            # failure when retrieving desc? then save it as empty .desc
-            xmlfiledesc = ''
-        f.write(xmlfiledesc.encode('utf-8'))
-        f.close()
-        delay(config=config, session=session)
-        c += 1
-        if c % 10 == 0:
-            print '    Downloaded %d images' % (c)
-
-    print 'Downloaded %d images' % (c)
+    f = open('%s/%s.desc' % (imagepath, filename2), 'w')
+    # <text xml:space="preserve" bytes="36">Banner featuring SG1, SGA, SGU teams</text>
+    if not re.search(r'</mediawiki>', xmlfiledesc):
+        # failure when retrieving desc? then save it as empty .desc
+        xmlfiledesc = ''
+    f.write(xmlfiledesc.encode('utf-8'))
+    f.close()
+    return xmlfiledesc
 
 
 def saveLogs(config={}, session=None):
@@ -1454,16 +3060,62 @@ def getParameters(params=[]):
         default=0,
         type=float,
         help="adds a delay (in seconds)")
+    parser.add_argument(
+        '--maxrate',
+        metavar=10,
+        default=0,
+        type=float,
+        help="maximum requests per second; the rate adapts to how the wiki answers (no maximum by default)")
+    parser.add_argument(
+        '--maxlag',
+        metavar=5,
+        default=5,
+        type=int,
+        help="seconds of replication lag at which the API should ask to wait (5 by default, 0 to disable)")
     parser.add_argument(
         '--retries',
         metavar=5,
         default=5,
         help="Maximum number of retries for ")
+    parser.add_argument(
+        '--workers',
+        metavar=4,
+        default=1,
+        type=int,
+        help="number of pages (and of namespaces while listing titles) to download at the same time (1 by default)")
+    parser.add_argument(
+        '--fsyncinterval',
+        metavar=100,
+        default=100,
+        type=int,
+        help="pages to write between syncs of the XML dump to disk, and in every block of a compressed one (100 by default)")
+    parser.add_argument(
+        '--largestfirst',
+        action='store_true',
+        help="start exporting the largest pages first among the next ones, using their sizes from the API (with --workers)")
+    parser.add_argument(
+        '--splithistories',
+        action='store_true',
+        help="export the long page histories in ranges of revisions fetched in parallel by the --workers (needs the API)")
+    parser.add_argument(
+        '--compress',
+        choices=sorted(xmlcompressions),
+        help="write the XML dump compressed with gzip, bz2, xz (needs the lzma module) or zstd (needs the zstandard module)")
+    parser.add_argument(
+        '--hostconnections',
+        metavar=4,
+        default=0,
+        type=int,
+        help="maximum connections to the same host while downloading images (--workers by default)")
     parser.add_argument('--path', help='path to store wiki dump at')
     parser.add_argument(
         '--resume',
         action='store_true',
         help='resumes previous incomplete dump (requires --path)')
+    parser.add_argument(
+        '--incremental',
+        metavar='PATH',
+        help='dumps only the changes since the dump in PATH (requires --xml and the API)')
     parser.add_argument('--force', action='store_true', help='')
     parser.add_argument(
         '--user', help='Username if authentication is required.')
@@ -1496,6 +3148,16 @@ def getParameters(params=[]):
         help="generates a full history XML dump (--xml --curonly for current revisions only)")
     groupDownload.add_argument('--curonly', action='store_true',
         help='store only the current version of pages')
+    groupDownload.add_argument(
+        '--batch',
+        metavar=50,
+        default=1,
+        type=int,
+        help='number of pages to export in every request (--xml --curonly only)')
+    groupDownload.add_argument(
+        '--pipeline',
+        action='store_true',
+        help='exports pages while their titles are still being listed')
     groupDownload.add_argument('--xmlrevisions', action='store_true',
                                help='download all revisions from an API generator. MediaWiki 1.27+ only.')
     groupDownload.add_argument(
@@ -1525,6 +3187,13 @@ def getParameters(params=[]):
     args = parser.parse_args()
     # print args
 
+    # Compression modules are optional
+    if (args.compress == 'xz' and lzma is None) or \
+            (args.compress == 'zstd' and zstandard is None):
+        print 'ERROR: Please install the %s module to use --compress %s' % (
+            args.compress == 'xz' and 'lzma (backports.lzma)' or 'zstandard', args.compress)
+        sys.exit(1)
+
     # Don't mix download params and meta info params
     if (args.xml or args.images) and \
             (args.get_wiki_engine):
@@ -1539,36 +3208,29 @@ def getParameters(params=[]):
         parser.print_help()
         sys.exit(1)
 
-    # Execute meta info params
-    if args.wiki:
-        if args.get_wiki_engine:
-            print getWikiEngine(url=args.wiki)
-            sys.exit()
-
     # Create session
     cj = cookielib.MozillaCookieJar()
     if args.cookies:
         cj.load(args.cookies)
         print 'Using cookies from %s' % args.cookies
 
-    session = requests.Session()
-    try:
-        from requests.packages.urllib3.util.retry import Retry
-        from requests.adapters import HTTPAdapter
-        # Courtesy datashaman https://stackoverflow.com/a/35504626
-        __retries__ = Retry(total=5,
-                        backoff_factor=2,
-                        status_forcelist=[500, 502, 503, 504])
-        session.mount('https://', HTTPAdapter(max_retries=__retries__))
-        session.mount('http://', HTTPAdapter(max_retries=__retries__))
-    except:
-        # Our urllib3/requests is too old
-        pass
-    session.cookies = cj
-    session.headers.update({'User-Agent': getUserAgent()})
+    # all the requests of all the threads share the pace; --delay is the
+    # shortest time between two of them
+    maxrate = args.maxrate
+    if args.delay > 0:
+        maxrate = min(maxrate or 1.0 / args.delay, 1.0 / args.delay)
+    # every worker thread needs its own connection to the wiki, and
+    # images use a pool for files and another for descriptions
+    session = createSession(maxrate=maxrate, poolsize=max(10, 2 * args.workers), cookies=cj)
     if args.user and args.password:
         session.auth = (args.user, args.password)
 
+    # Execute meta info params
+    if args.wiki:
+        if args.get_wiki_engine:
+            print getWikiEngine(url=args.wiki, session=session)
+            sys.exit()
+
     # check URLs
     for url in [args.api, args.index, args.wiki]:
         if url and (not url.startswith('http://') and not url.startswith('https://')):
@@ -1582,8 +3244,8 @@ def getParameters(params=[]):
     index = args.index and args.index or ''
     if api == '' or index == '':
         if args.wiki:
-            if getWikiEngine(args.wiki) == 'MediaWiki':
-                api2, index2 = mwGetAPIAndIndex(args.wiki)
+            if getWikiEngine(url=args.wiki, session=session) == 'MediaWiki':
+                api2, index2 = mwGetAPIAndIndex(url=args.wiki, session=session)
                 if not api:
                     api = api2
                 if not index:
@@ -1698,6 +3360,15 @@ def getParameters(params=[]):
         parser.print_help()
         sys.exit(1)
 
+    # --incremental requires --xml and the API
+    since = ''
+    if args.incremental:
+        if not args.xml or not api:
+            print "--incremental requires --xml and the API\n"
+            parser.print_help()
+            sys.exit(1)
+        since = getDeltaSince(path=os.path.normpath(args.incremental))
+
     config = {
         'curonly': args.curonly,
         'date': datetime.datetime.now().strftime('%Y%m%d'),
@@ -1714,6 +3385,17 @@ def getParameters(params=[]):
         'cookies': args.cookies or '',
         'delay': args.delay,
         'retries': int(args.retries),
+        'maxlag': max(0, args.maxlag),
+        'workers': max(1, args.workers),
+        'fsyncinterval': max(1, args.fsyncinterval),
+        'compress': args.compress,
+        'splithistories': args.splithistories,
+        'largestfirst': args.largestfirst,
+        'hostconnections': max(0, args.hostconnections),
+        'batch': max(1, args.batch),
+        'pipeline': args.pipeline,
+        'incremental': args.incremental and os.path.abspath(args.incremental) or '',
+        'since': since,
     }
 
     other = {
@@ -1829,36 +3511,39 @@ def fixBOM(request):
 
 def checkXMLIntegrity(config={}, titles=[], session=None):
     """ Check XML dump integrity, to detect broken XML chunks """
-    return
+    # the state of every page is in the resume index: only where every
+    # page begins and ends in the XML has to be read
+    xmlfilename = '%s/%s' % (config['path'], getXMLFileName(config=config))
+    if config['xmlrevisions'] or not os.path.exists('%s.idx' % (xmlfilename)):
+        return
 
     print 'Verifying dump...'
-    checktitles = 0
-    checkpageopen = 0
-    checkpageclose = 0
-    checkrevisionopen = 0
-    checkrevisionclose = 0
-    for line in file(
-            '%s/%s-%s-%s.xml' %
-            (config['path'],
-             domain2prefix(
-                config=config,
-                session=session),
-                config['date'],
-                config['curonly'] and 'current' or 'history'),
-            'r').read().splitlines():
-        if "<revision>" in line:
-            checkrevisionopen += 1
-        elif "</revision>" in line:
-            checkrevisionclose += 1
-        elif "<page>" in line:
-            checkpageopen += 1
-        elif "</page>" in line:
-            checkpageclose += 1
-        elif "<title>" in line:
-            checktitles += 1
-        else:
-            continue
-    if (checktitles == checkpageopen and checktitles == checkpageclose and checkrevisionopen == checkrevisionclose):
+    statuses = collections.Counter()
+    revisions = 0
+    broken = []
+    size = os.path.getsize(xmlfilename)
+    with open(xmlfilename, 'rb') as xmlfile:
+        for record in readXMLState(config=config):
+            statuses[record['status']] += 1
+            revisions += record['revisions']
+            if record['status'] != 'done' or record['xmlstart'] < 0:
+                continue
+            if config.get('compress'):
+                # only the block of the page can be checked without
+                # decompressing it
+                ok = record['xmlstart'] < size and record['xmloffset'] <= size
+            else:
+                xmlfile.seek(record['xmlstart'])
+                ok = xmlfile.read(16).lstrip().startswith('<page>')
+                xmlfile.seek(max(0, record['xmloffset'] - 8))
+                ok = ok and xmlfile.read(8) == '</page>\n'
+            if not ok:
+                broken.append(record['title'])
+    print '%d pages (%d missing in the wiki, %d failed, %d with only the last revision), %d revisions' % (
+        sum(statuses.values()), statuses['missing'], statuses['failed'], statuses['degraded'], revisions)
+    for title in broken[:10]:
+        print '    The XML of "%s" is broken' % (title.decode('utf-8'))
+    if not broken:
         pass
     else:
         print 'XML dump seems to be corrupted.'
@@ -1877,9 +3562,21 @@ def createNewDump(config={}, other={}):
     images = []
     print 'Trying generating a new dump into a new directory...'
     if config['xml']:
-        getPageTitles(config=config, session=other['session'])
-        titles=readTitles(config)
-        generateXMLDump(config=config, titles=titles, session=other['session'])
+        if config.get('pipeline') and not config['xmlrevisions']:
+            # pages are exported as soon as their titles are listed, by
+            # following the titles list while another thread writes it
+            lister = threading.Thread(
+                target=getPageTitles,
+                kwargs={'config': config, 'session': other['session']})
+            lister.daemon = True
+            lister.start()
+            generateXMLDump(config=config, session=other['session'], follow=lister.is_alive)
+            lister.join()
+            titles=readTitles(config)
+        else:
+            getPageTitles(config=config, session=other['session'])
+            titles=readTitles(config)
+            generateXMLDump(config=config, titles=titles, session=other['session'])
         checkXMLIntegrity(
             config=config,
             titles=titles,
@@ -1924,21 +3621,24 @@ def resumePreviousDump(config={}, other={}):
         # checking xml dump
         xmliscomplete = False
         lastxmltitle = None
+        # the index, if any, knows where to continue without reading the
+        # XML backwards nor the titles list
+        resume = readXMLIndex(config=config)
+        xmlfilename = '%s/%s' % (config['path'], getXMLFileName(config=config))
         try:
-            f = reverse_readline(
-                '%s/%s-%s-%s.xml' %
-                (config['path'],
-                 domain2prefix(
-                    config=config,
-                    session=other['session']),
-                    config['date'],
-                    config['curonly'] and 'current' or 'history'),
-                )
+            if config.get('compress'):
+                # compressed dumps can only be resumed from their index
+                xmliscomplete = isXMLDumpComplete(xmlfilename, compress=config['compress'])
+                f = []
+            else:
+                f = reverse_readline(xmlfilename)
             for l in f:
                 if l == '</mediawiki>':
                     # xml dump is complete
                     xmliscomplete = True
                     break
+                if resume and l:
+                    break
 
                 xmltitle = re.search(r'<title>([^<]+)</title>', l)
                 if xmltitle:
@@ -1949,6 +3649,12 @@ def resumePreviousDump(config={}, other={}):
 
         if xmliscomplete:
             print 'XML dump was completed in the previous session'
+        elif resume:
+            print 'Resuming XML dump after "%s" (%d pages done)' % (resume['title'], resume['pages'])
+            generateXMLDump(
+                config=config,
+                resume=resume,
+                session=other['session'])
         elif lastxmltitle:
             # resuming...
             print 'Resuming XML dump from "%s"' % (lastxmltitle)
@@ -1980,7 +3686,9 @@ def resumePreviousDump(config={}, other={}):
             lines = raw.split('\n')
             for l in lines:
                 if re.search(r'\t', l):
-                    images.append(l.split('\t'))
+                    image = l.split('\t')
+                    # lists from older versions have no size and sha1
+                    images.append(image + [u''] * (5 - len(image)))
             lastimage = lines[-1]
             f.close()
         except:
@@ -2004,7 +3712,7 @@ def resumePreviousDump(config={}, other={}):
         lastfilename = ''
         lastfilename2 = ''
         c = 0
-        for filename, url, uploader in images:
+        for filename, url, uploader, size, sha1 in images:
             lastfilename2 = lastfilename
             # return always the complete filename, not the truncated
             lastfilename = filename
@@ -2074,34 +3782,37 @@ def saveSiteInfo(config={}, session=None):
             print 'Downloading site info as siteinfo.json'
 
             # MediaWiki 1.13+
-            r = session.post(
-                url=config['api'],
+            r = apiRequest(
+                config=config,
                 params={
                     'action': 'query',
                     'meta': 'siteinfo',
                     'siprop': 'general|namespaces|statistics|dbrepllag|interwikimap|namespacealiases|specialpagealiases|usergroups|extensions|skins|magicwords|fileextensions|rightsinfo',
                     'sinumberingroup': 1,
                     'format': 'json'},
+                session=session,
                 timeout=10)
             # MediaWiki 1.11-1.12
             if not 'query' in getJSON(r):
-                r = session.post(
-                    url=config['api'],
+                r = apiRequest(
+                    config=config,
                     params={
                         'action': 'query',
                         'meta': 'siteinfo',
                         'siprop': 'general|namespaces|statistics|dbrepllag|interwikimap',
                         'format': 'json'},
+                    session=session,
                     timeout=10)
             # MediaWiki 1.8-1.10
             if not 'query' in getJSON(r):
-                r = session.post(
-                    url=config['api'],
+                r = apiRequest(
+                    config=config,
                     params={
                         'action': 'query',
                         'meta': 'siteinfo',
                         'siprop': 'general|namespaces',
                         'format': 'json'},
+                    session=session,
                     timeout=10)
             result = getJSON(r)
             delay(config=config, session=session)
@@ -2128,11 +3839,11 @@ def avoidWikimediaProjects(config={}, other={}):
             sys.exit()
 
 
-def getWikiEngine(url=''):
+def getWikiEngine(url='', session=None):
     """ Returns the wiki engine of a URL, if known """
 
-    session = requests.Session()
-    session.headers.update({'User-Agent': getUserAgent()})
+    if session is None:
+        session = createSession()
     r = session.post(url=url, timeout=30)
     if r.status_code == 405 or r.text == '':
         r = session.get(url=url, timeout=120)
@@ -2211,13 +3922,13 @@ def getWikiEngine(url=''):
     return wikiengine
 
 
-def mwGetAPIAndIndex(url=''):
+def mwGetAPIAndIndex(url='', session=None):
     """ Returns the MediaWiki API and Index.php """
 
     api = ''
     index = ''
-    session = requests.Session()
-    session.headers.update({'User-Agent': getUserAgent()})
+    if session is None:
+        session = createSession()
     r = session.post(url=url, timeout=120)
     result = r.text
 
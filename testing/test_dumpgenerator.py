@@ -16,12 +16,14 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 import datetime
+import gzip
 import json
 try:
     from hashlib import md5
 except ImportError:             # Python 2.4 compatibility
     from md5 import new as md5
 import os
+import re
 import requests
 import shutil
 import time
@@ -29,7 +31,35 @@ import unittest
 import urllib
 import urllib2
 import tempfile
-from dumpgenerator import delay, domain2prefix, getImageNames, getPageTitles, getUserAgent, getWikiEngine, mwGetAPIAndIndex
+from dumpgenerator import apiRequest, delay, domain2prefix, exportXMLPages, foldChanges, getChangesAPI, getImageNames, getPageTitles, getUserAgent, getWikiEngine, getXMLCurrentRevisions, isImageSaved, isXMLDumpComplete, makeXmlFromPage, mwGetAPIAndIndex, orderedMap, parseRetryAfter, parseXMLIndexRecord, RateLimiter, readTitles, readXMLBlock, splitRevisions, TitleSet, truncateXMLDump, XMLChunkScanner, XMLDumpWriter
+
+def stubResponse(body={}, status=200, headers={}):
+    """ A response of the wiki, with body as JSON unless it is a string """
+    r = requests.models.Response()
+    r.status_code = status
+    r.headers.update(headers)
+    r._content = isinstance(body, str) and body or json.dumps(body)
+    r._content_consumed = True
+    r.encoding = 'utf-8'
+    return r
+
+
+class StubSession(object):
+    """ Answers every request with answer(parameters), keeping the
+        parameters of every request """
+    def __init__(self, answer=None):
+        self.answer = answer
+        self.requests = []
+        self.bodies = []
+        self.ratelimiter = RateLimiter()
+
+    def post(self, url='', params={}, data={}, **kwargs):
+        self.bodies.append(data)
+        params = dict(params or {}, **(data or {}))
+        self.requests.append(params)
+        return self.answer(params)
+    get = post
+
 
 class TestDumpgenerator(unittest.TestCase):
     # Documentation
@@ -52,6 +82,441 @@ class TestDumpgenerator(unittest.TestCase):
             print 'Elapsed time in seconds (approx.):', t2
             self.assertTrue(t2 + 0.01 > i and t2 < i + 1)
     
+    def test_RateLimiter(self):
+        print '\n', '#'*73, '\n', 'test_RateLimiter', '\n', '#'*73
+        limiter = RateLimiter(maxrate=20)
+        t1 = time.time()
+        for i in range(11):
+            limiter.wait()
+        # 10 intervals of 1/20 seconds
+        self.assertTrue(0.45 < time.time() - t1 < 1)
+        # the rate halves on failures, once a second at most, and grows back
+        limiter.failure()
+        limiter.failure()
+        self.assertEqual(limiter.rate, 10)
+        limiter.success()
+        self.assertEqual(limiter.rate, 10.1)
+        # Retry-After stops every request until it is over
+        limiter.decreased = 0
+        limiter.failure(retryafter=1)
+        t1 = time.time()
+        limiter.wait()
+        self.assertTrue(0.9 < time.time() - t1 < 1.5)
+        self.assertEqual(parseRetryAfter('120'), 120)
+        self.assertEqual(parseRetryAfter('Wed, 21 Oct 2015 07:28:00 GMT'), 0)
+        self.assertEqual(parseRetryAfter(None), 0)
+
+    def test_apiRequest(self):
+        # This test checks that the API requests wait and are sent again
+        # when the wiki is lagged or failing, for as long as it says
+
+        print '\n', '#'*73, '\n', 'test_apiRequest', '\n', '#'*73
+        ok = {'query': {'general': {'sitename': u'Wiki'}}}
+        config = {'api': 'http://wiki/api.php', 'retries': 1}
+        for answers in [
+                # lagged replicas, as told by the header or only the body
+                [stubResponse({'error': {'code': 'maxlag'}}, headers={'MediaWiki-API-Error': 'maxlag', 'Retry-After': '1'}),
+                 stubResponse(ok)],
+                [stubResponse({'error': {'code': 'maxlag'}}, headers={'Retry-After': '1'}), stubResponse(ok)],
+                # overloaded, or rate limited
+                [stubResponse('Service Unavailable', status=503, headers={'Retry-After': '1'}), stubResponse(ok)],
+                [stubResponse('Too Many Requests', status=429, headers={'Retry-After': '1'}), stubResponse(ok)]]:
+            session = StubSession(answer=lambda params: answers.pop(0))
+            t1 = time.time()
+            r = apiRequest(config=config, params={'action': 'query', 'meta': 'siteinfo'}, session=session)
+            self.assertTrue(0.9 < time.time() - t1 < 1.5)
+            self.assertEqual(r.json(), ok)
+            self.assertEqual(len(session.requests), 2)
+            for params in session.requests:
+                self.assertEqual(params['maxlag'], 5)
+        # after the retries the dump stops, to be resumed later
+        session = StubSession(answer=lambda params: stubResponse('Service Unavailable', status=503, headers={'Retry-After': '1'}))
+        self.assertRaises(SystemExit, apiRequest, config=config, params={'action': 'query'}, session=session)
+        self.assertEqual(len(session.requests), 2)
+
+    def test_orderedMap(self):
+        # This test checks that results come back in order, whatever
+        # the number of workers and the time every item takes
+
+        print '\n', '#'*73, '\n', 'test_orderedMap', '\n', '#'*73
+        def slow(i):
+            time.sleep((i % 3) * 0.01)
+            return i * 2
+        for workers in [1, 2, 5]:
+            print 'Testing workers:', workers
+            self.assertEqual(list(orderedMap(function=slow, items=iter(range(20)), workers=workers)), [i * 2 for i in range(20)])
+
+        def broken(i):
+            if i == 3:
+                raise ValueError(i)
+            return i
+        self.assertRaises(ValueError, list, orderedMap(function=broken, items=range(10), workers=3))
+
+        # the highest priorities start first, the results stay in order
+        started = []
+        def record(i):
+            started.append(i)
+            if i < 2:
+                time.sleep(0.1)  # the other items wait in the window
+            return i
+        self.assertEqual(list(orderedMap(function=record, items=range(10), workers=2, window=10, priority=lambda i: i < 2 and 100 - i or i)), range(10))
+        self.assertEqual(sorted(started[:2]), [0, 1])
+        self.assertEqual(started[2:], range(9, 1, -1))
+
+    def test_foldChanges(self):
+        # This test checks which pages an incremental dump exports after
+        # sequences of moves, deletions and restores
+
+        print '\n', '#'*73, '\n', 'test_foldChanges', '\n', '#'*73
+        events = [
+            # moved, the target deleted and restored: both exist
+            ('2020-01-01T00:00:04Z', u'B', 'restore', None),
+            ('2020-01-01T00:00:01Z', u'A', 'edit', None),
+            ('2020-01-01T00:00:02Z', u'A', 'move', u'B'),
+            ('2020-01-01T00:00:03Z', u'B', 'delete', None),
+            # edited then deleted: gone
+            ('2020-01-01T00:00:01Z', u'C', 'edit', None),
+            ('2020-01-01T00:00:05Z', u'C', 'delete', None),
+            # restored, moved and the target deleted: only the redirect left
+            ('2020-01-01T00:00:06Z', u'D', 'delete', None),
+            ('2020-01-01T00:00:07Z', u'D', 'restore', None),
+            ('2020-01-01T00:00:08Z', u'D', 'move', u'E'),
+            ('2020-01-01T00:00:09Z', u'E', 'delete', None),
+            # only moved, the source was not changed otherwise
+            ('2020-01-01T00:00:10Z', u'F', 'move', u'G'),
+        ]
+        changes = foldChanges(events=events)
+        self.assertEqual(changes['titles'], [u'A', u'B', u'D', u'G'])
+        self.assertEqual([(move['from'], move['to']) for move in changes['moved']], [(u'A', u'B'), (u'D', u'E'), (u'F', u'G')])
+        self.assertEqual([deletion['title'] for deletion in changes['deleted']], [u'B', u'C', u'D', u'E'])
+        self.assertEqual([restore['title'] for restore in changes['restored']], [u'B', u'D'])
+        self.assertEqual(foldChanges(events=[]), {'titles': [], 'moved': [], 'deleted': [], 'restored': []})
+
+    def test_getChangesAPI(self):
+        # This test checks where the edits of an incremental dump come
+        # from: recent changes if they go back to since, all revisions if
+        # not, and recent changes again if the wiki has no allrevisions
+
+        print '\n', '#'*73, '\n', 'test_getChangesAPI', '\n', '#'*73
+        def wiki(oldest='', allrevisions=True):
+            def answer(params):
+                if params.get('list') == 'recentchanges' and params.get('rclimit') == 1:
+                    return stubResponse({'query': {'recentchanges': [{'timestamp': oldest}]}})
+                if params.get('list') == 'recentchanges':
+                    return stubResponse({'query': {'recentchanges': [{'title': u'Recent', 'ns': 0, 'timestamp': oldest}]}})
+                if params.get('list') == 'allrevisions' and allrevisions:
+                    return stubResponse({'query': {'allrevisions': [
+                        {'title': u'Old', 'ns': 0, 'revisions': [{'timestamp': '2020-01-02T00:00:00Z'}]}]}})
+                if params.get('list') == 'allrevisions':
+                    # MediaWiki before 1.27
+                    return stubResponse({'warnings': {'main': {'*': "Unrecognized value for parameter 'list': allrevisions"}}})
+                return stubResponse({'query': {'logevents': []}})
+            return StubSession(answer=answer)
+
+        config = {'api': 'http://wiki/api.php', 'since': '2020-01-01T00:00:00Z', 'namespaces': ['all'],
+                  'exnamespaces': [], 'delay': 0, 'retries': 0, 'maxlag': 0, 'path': tempfile.mkdtemp()}
+        for oldest, allrevisions, titles, lists in [
+                ('2019-12-01T00:00:00Z', True, [u'Recent'], ['recentchanges']),
+                ('2020-02-01T00:00:00Z', True, [u'Old'], ['allrevisions']),
+                ('2020-02-01T00:00:00Z', False, [u'Recent'], ['allrevisions', 'recentchanges'])]:
+            session = wiki(oldest=oldest, allrevisions=allrevisions)
+            changes = getChangesAPI(config=config, session=session)
+            self.assertEqual(changes['titles'], titles)
+            # the edits are listed after the oldest recent change is checked
+            self.assertEqual([params['list'] for params in session.requests[1:]
+                              if params['list'] != 'logevents'], lists)
+        # the missing edits are in the errors log
+        self.assertTrue('edits between 2020-01-01T00:00:00Z' in open('%s/errors.log' % (config['path'])).read())
+        shutil.rmtree(config['path'])
+
+    def test_getXMLCurrentRevisions(self):
+        # This test exports the last revisions of a wiki whose API cuts
+        # their content, with the continuation of new and old MediaWiki:
+        # every page must be exported once, and only once
+
+        print '\n', '#'*73, '\n', 'test_getXMLCurrentRevisions', '\n', '#'*73
+        def page(title, revision=True):
+            page = {'pageid': ord(title), 'ns': 0, 'title': title}
+            if revision:
+                page['revisions'] = [{'revid': ord(title), 'timestamp': '2020-01-01T00:00:00Z',
+                                      'user': u'Alice', 'userid': 1, 'contentmodel': 'wikitext', '*': title}]
+            return page
+        def wiki(oldcontinue=False):
+            def answer(params):
+                if params.get('meta') == 'userinfo':
+                    return stubResponse({'query': {'userinfo': {'rights': []}}})
+                if params.get('gapcontinue') == 'D':
+                    if 'rvcontinue' in params:
+                        return stubResponse({'error': {'code': 'badcontinue'}})
+                    return stubResponse({'query': {'pages': {'68': page(u'D'), '69': page(u'E')}}})
+                if params.get('rvcontinue') == 'C':
+                    # the content that did not fit in the first result
+                    result = {'query': {'pages': {'65': page(u'A', False), '66': page(u'B', False), '67': page(u'C')}}}
+                    if oldcontinue:
+                        result['query-continue'] = {'allpages': {'gapcontinue': 'D'}}
+                    else:
+                        result['continue'] = {'gapcontinue': 'D', 'continue': 'gapcontinue||'}
+                    return stubResponse(result)
+                result = {'query': {'pages': {'65': page(u'A'), '66': page(u'B'), '67': page(u'C', False)}}}
+                if oldcontinue:
+                    result['query-continue'] = {'revisions': {'rvcontinue': 'C'}, 'allpages': {'gapcontinue': 'D'}}
+                else:
+                    result['continue'] = {'rvcontinue': 'C', 'continue': 'gapcontinue||'}
+                return stubResponse(result)
+            return StubSession(answer=answer)
+
+        config = {'api': 'http://wiki/api.php', 'exnamespaces': [],
+                  'delay': 0, 'retries': 0, 'maxlag': 0, 'path': tempfile.mkdtemp()}
+        for oldcontinue in [False, True]:
+            session = wiki(oldcontinue=oldcontinue)
+            xml = u''.join([u''.join(pieces) for pieces in getXMLCurrentRevisions(
+                config=config, namespaces=[0], session=session)])
+            self.assertEqual(re.findall(r'<title>([^<]*)</title>', xml), [u'A', u'B', u'C', u'D', u'E'])
+            self.assertEqual(len(session.requests), 4)
+        shutil.rmtree(config['path'])
+
+    def test_readTitles(self):
+        # This test reads a list of titles while it is being written, with
+        # the lister finishing it at the worst moment
+
+        print '\n', '#'*73, '\n', 'test_readTitles', '\n', '#'*73
+        config = {'api': 'http://wiki/api.php', 'date': '20200101', 'path': tempfile.mkdtemp()}
+        titlesfilename = '%s/%s-%s-titles.txt' % (config['path'], domain2prefix(config=config), config['date'])
+        def lister(writes):
+            # each check of the lister writes the next piece of the list,
+            # and tells whether it is still running after it
+            def follow():
+                if writes:
+                    with open(titlesfilename, 'a') as f:
+                        f.write(writes.pop(0))
+                return bool(writes)
+            return follow
+
+        for writes, expected in [
+                # finished between the read of the end of the file and the check
+                (['Main Page\nTal', 'k:Main Page\n--END--\n'], ['Main Page', 'Talk:Main Page']),
+                # more titles while waiting
+                (['Main Page\n', 'Talk:Main Page\n', '--END--\n'], ['Main Page', 'Talk:Main Page']),
+                # the lister stopped without finishing: the cut title is not read
+                (['Main Page\nTal', 'k:Main'], None)]:
+            open(titlesfilename, 'w').close()
+            titles = readTitles(config=config, follow=lister(writes))
+            if expected is None:
+                self.assertEqual(titles.next(), 'Main Page')
+                self.assertRaises(SystemExit, titles.next)
+            else:
+                self.assertEqual(list(titles), expected)
+        shutil.rmtree(config['path'])
+
+    def test_TitleSet(self):
+        print '\n', '#'*73, '\n', 'test_TitleSet', '\n', '#'*73
+        titles = TitleSet()
+        self.assertTrue(titles.add(u'Main Page'))
+        self.assertTrue(titles.add(u'Talk:Main Page'))
+        self.assertTrue(titles.add(u'Caf\xe9'))
+        self.assertFalse(titles.add(u'Main Page'))
+        # utf-8 and unicode titles are the same title
+        self.assertFalse(titles.add(u'Caf\xe9'.encode('utf-8')))
+        self.assertTrue(u'Talk:Main Page' in titles)
+        self.assertFalse(u'User:Main Page' in titles)
+        self.assertEqual(len(titles), 3)
+
+    def test_makeXmlFromPage(self):
+        print '\n', '#'*73, '\n', 'test_makeXmlFromPage', '\n', '#'*73
+        page = {'title': u'A & <B>', 'ns': 0, 'pageid': 7, 'revisions': [
+            {'revid': 1, 'parentid': 0, 'timestamp': '2010-01-01T00:00:00Z', 'user': u'Bob', 'userid': 3, 'minor': '',
+             'comment': u'first', 'contentmodel': 'wikitext', 'contentformat': 'text/x-wiki', '*': u'caf\xe9 <b>', 'size': 10, 'sha1': 'abc'},
+            {'revid': 2, 'parentid': 1, 'timestamp': '2010-01-02T00:00:00Z', 'user': u'127.0.0.1', 'anon': '', 'userid': 0,
+             'comment': u'', 'texthidden': '', 'size': 0, 'sha1': ''},
+            # registered users have no userid before MediaWiki 1.17, and 0 if imported
+            {'revid': 3, 'parentid': 2, 'timestamp': '2010-01-03T00:00:00Z', 'user': u'Carol', '*': u'x', 'sha1': 'def'},
+            {'revid': 4, 'parentid': 3, 'timestamp': '2010-01-04T00:00:00Z', 'user': u'Dan', 'userid': 0, '*': u'y', 'sha1': 'ghi'},
+        ]}
+        xml = makeXmlFromPage(page)
+        # same elements, order and indentation as Special:Export
+        self.assertEqual(xml, u'\n'.join([
+            u'  <page>', u'    <title>A &amp; &lt;B&gt;</title>', u'    <ns>0</ns>', u'    <id>7</id>',
+            u'    <revision>', u'      <id>1</id>', u'      <timestamp>2010-01-01T00:00:00Z</timestamp>',
+            u'      <contributor>', u'        <username>Bob</username>', u'        <id>3</id>', u'      </contributor>',
+            u'      <minor />', u'      <comment>first</comment>', u'      <model>wikitext</model>', u'      <format>text/x-wiki</format>',
+            u'      <text xml:space="preserve" bytes="10">caf\xe9 &lt;b&gt;</text>', u'      <sha1>abc</sha1>', u'    </revision>',
+            u'    <revision>', u'      <id>2</id>', u'      <parentid>1</parentid>', u'      <timestamp>2010-01-02T00:00:00Z</timestamp>',
+            u'      <contributor>', u'        <ip>127.0.0.1</ip>', u'      </contributor>',
+            u'      <text deleted="deleted" />', u'      <sha1 />', u'    </revision>',
+            u'    <revision>', u'      <id>3</id>', u'      <parentid>2</parentid>', u'      <timestamp>2010-01-03T00:00:00Z</timestamp>',
+            u'      <contributor>', u'        <username>Carol</username>', u'      </contributor>',
+            u'      <text xml:space="preserve" bytes="1">x</text>', u'      <sha1>def</sha1>', u'    </revision>',
+            u'    <revision>', u'      <id>4</id>', u'      <parentid>3</parentid>', u'      <timestamp>2010-01-04T00:00:00Z</timestamp>',
+            u'      <contributor>', u'        <username>Dan</username>', u'      </contributor>',
+            u'      <text xml:space="preserve" bytes="1">y</text>', u'      <sha1>ghi</sha1>', u'    </revision>',
+            u'  </page>', u'']))
+
+    def test_XMLChunkScanner(self):
+        # This test scans a Special:Export document fed in pieces of
+        # several sizes and checks the trimmed output and counters
+
+        print '\n', '#'*73, '\n', 'test_XMLChunkScanner', '\n', '#'*73
+        xml = (
+            '<mediawiki xml:lang="en">\n  <siteinfo>\n    <sitename>Test</sitename>\n  </siteinfo>\n'
+            '  <page>\n    <title>A &amp; B</title>\n    <sha1>abc</sha1>\n'
+            '    <revision>\n      <timestamp>2011-01-01T00:00:00Z</timestamp>\n      <text xml:space="preserve">x &lt;page&gt;\ny</text>\n      <sha1>def</sha1>\n    </revision>\n'
+            '    <revision>\n      <timestamp>2012-01-01T00:00:00Z</timestamp>\n      <text xml:space="preserve" />\n    </revision>\n'
+            '  </page>\n</mediawiki>\n')
+        for size in [1, 7, 64, len(xml)]:
+            print 'Testing pieces of:', size
+            for header, continuation, expected in [
+                    (True, False, xml.split('</page>')[0].replace('    <sha1>abc</sha1>\n', '')),
+                    (False, False, xml.split('</siteinfo>\n')[1].split('</page>')[0].replace('    <sha1>abc</sha1>\n', '')),
+                    (False, True, '  <revision>' + '<revision>'.join(xml.split('</page>')[0].split('<revision>')[1:]))]:
+                chunk = []
+                scanner = XMLChunkScanner(write=chunk.append, header=header, continuation=continuation)
+                for i in range(0, len(xml), size):
+                    scanner.feed(xml[i:i + size])
+                scanner.close()
+                self.assertEqual(''.join(chunk), expected)
+                self.assertEqual(scanner.revisions, 2)
+                self.assertEqual(scanner.lasttimestamp, '2012-01-01T00:00:00Z')
+                self.assertEqual(scanner.pages, 1)
+                self.assertTrue(scanner.complete)
+
+    def test_exportXMLPages(self):
+        # This test checks how a batch of titles exported together is split
+        # into their pages, and that the titles missing from it are tried
+        # again alone
+
+        print '\n', '#'*73, '\n', 'test_exportXMLPages', '\n', '#'*73
+        def page(title):
+            return ('  <page>\n    <title>%s</title>\n    <ns>0</ns>\n    <id>1</id>\n'
+                    '    <revision>\n      <id>1</id>\n      <timestamp>2010-01-01T00:00:00Z</timestamp>\n'
+                    '      <text xml:space="preserve">text of %s</text>\n    </revision>\n  </page>\n') % (title, title)
+        exported = {
+            'Main_Page': page('Main Page'),
+            'A_&_<b>': page('A &amp; &lt;b&gt;'),
+            'Late': page('Late'),
+        }
+        def answer(params):
+            # the batch answers with its pages in any order, Late only alone
+            titles = params['pages'].split('\n')
+            if len(titles) > 1:
+                titles = [title for title in reversed(titles) if title != 'Late']
+            return stubResponse('<mediawiki xml:lang="en">\n  <siteinfo>\n  </siteinfo>\n%s</mediawiki>\n' % (
+                ''.join([exported.get(title, '') for title in titles])))
+        session = StubSession(answer=answer)
+        config = {'index': 'http://wiki/index.php', 'api': '', 'curonly': True, 'batch': 4, 'retries': 1,
+                  'failfast': False, 'delay': 0, 'path': tempfile.mkdtemp()}
+        titles = ['Main Page', 'Missing', 'A & <b>', 'Late']
+        results = exportXMLPages(config=config, titles=titles, session=session)
+        self.assertEqual([(title, revisions, status) for title, pagefile, revisions, status in results], [
+            ('Main Page', 1, 'done'), ('Missing', 0, 'missing'), ('A & <b>', 1, 'done'), ('Late', 1, 'done')])
+        for (title, pagefile, revisions, status), expected in zip(results, ['Main_Page', None, 'A_&_<b>', 'Late']):
+            if expected is None:
+                self.assertEqual(pagefile, None)
+            else:
+                pagefile.seek(0)
+                self.assertEqual(pagefile.read(), exported[expected])
+        # the batch went in the body of the request, the titles alone after it
+        self.assertEqual(session.bodies[0]['pages'], 'Main_Page\nMissing\nA_&_<b>\nLate')
+        self.assertEqual([params['pages'] for params in session.requests[1:]], ['Missing', 'Late'])
+        shutil.rmtree(config['path'])
+
+    def test_truncateXMLDump(self):
+        # This test removes incomplete pages from the end of XML dumps,
+        # with </page> across the boundaries of the blocks read
+
+        print '\n', '#'*73, '\n', 'test_truncateXMLDump', '\n', '#'*73
+        complete = '<mediawiki>\n' + '  <page>\n    <title>A</title>\n  </page>\n' * 50
+        path = tempfile.mkdtemp()
+        filename = '%s/dump.xml' % (path)
+        for rest in ['', '  <page>\n    <title>B</title>\n    <revision>\n', '</mediawiki>', '  </pa']:
+            for buf_size in [3, 8, 100, 8192]:
+                with open(filename, 'wb') as f:
+                    f.write(complete + rest)
+                self.assertEqual(truncateXMLDump(filename, buf_size=buf_size), len(complete))
+                self.assertEqual(open(filename, 'rb').read(), complete)
+        with open(filename, 'wb') as f:
+            f.write('<mediawiki>\n  <siteinfo>\n')
+        self.assertEqual(truncateXMLDump(filename), None)
+        shutil.rmtree(path)
+
+    def test_XMLDumpWriter(self):
+        # This test writes compressed XML dumps, cuts them after the last
+        # commit as a crash would, and resumes them
+
+        print '\n', '#'*73, '\n', 'test_XMLDumpWriter', '\n', '#'*73
+        page = '  <page>\n    <title>A &amp; B</title>\n    <ns>0</ns>\n    <id>1</id>\n  </page>\n'
+        path = tempfile.mkdtemp()
+        filename = '%s/dump.xml.gz' % (path)
+        writer = XMLDumpWriter(filename=filename, interval=3, header='<mediawiki>\n', compress='gzip')
+        for i in range(7):
+            writer.write(page)
+            writer.addPage(title='A', titlesoffset=i)
+        writer.commit()
+        writer.write('</mediawiki>\n')
+        writer.close()
+        complete = '<mediawiki>\n' + page * 7 + '</mediawiki>\n'
+        self.assertEqual(gzip.open(filename, 'rb').read(), complete)
+        self.assertTrue(isXMLDumpComplete(filename, compress='gzip'))
+
+        # a record for every page, the dump can be cut after every commit
+        records = open('%s.idx' % (filename), 'rb').read().splitlines()
+        self.assertEqual(len(records), 7)
+        state = [parseXMLIndexRecord(r) for r in records]
+        self.assertEqual([r['pages'] for r in state if r['xmloffset'] >= 0], [3, 6, 7])
+        self.assertEqual(set([r['status'] for r in state]), set(['done']))
+        xmloffset = state[5]['xmloffset']
+        with open(filename, 'r+b') as f:
+            f.truncate(xmloffset + 10)
+        self.assertFalse(isXMLDumpComplete(filename, compress='gzip'))
+        writer = XMLDumpWriter(filename=filename, interval=3, compress='gzip', resume={
+            'pages': 6, 'xmloffset': xmloffset,
+            'indexoffset': sum([len(r) + 1 for r in records[:6]])})
+        writer.write(page)
+        writer.addPage(title='A', titlesoffset=6)
+        writer.commit()
+        writer.write('</mediawiki>\n')
+        writer.close()
+        self.assertEqual(gzip.open(filename, 'rb').read(), complete)
+        self.assertEqual(open('%s.idx' % (filename), 'rb').read().splitlines(), records)
+
+        # every page can be read from its block alone
+        blocks = [l.split(':', 2) for l in open('%s/dump-index.txt' % (path), 'rb').read().splitlines()]
+        self.assertEqual(len(blocks), 7)
+        self.assertEqual(len(set([offset for offset, pageid, title in blocks])), 3)
+        for offset, pageid, title in blocks:
+            self.assertEqual((pageid, title), ('1', 'A & B'))
+            self.assertTrue(readXMLBlock(filename, offset=int(offset), compress='gzip').startswith(page))
+        shutil.rmtree(path)
+
+    def test_splitRevisions(self):
+        # This test splits the revisions of a long history into ranges of
+        # Special:Export offsets, never between two of the same second
+
+        print '\n', '#'*73, '\n', 'test_splitRevisions', '\n', '#'*73
+        timestamps = ['2010-01-01T00:00:%02dZ' % (i) for i in [1, 2, 3, 3, 3, 4, 5, 6, 7]]
+        self.assertEqual(splitRevisions(timestamps=timestamps, since='2010', size=3), [
+            ('2010', 5), ('2010-01-01T00:00:03Z', 3), ('2010-01-01T00:00:06Z', 1)])
+        self.assertEqual(splitRevisions(timestamps=timestamps, since='2010', size=100), [('2010', 9)])
+        self.assertEqual(splitRevisions(timestamps=[], since='2010'), [])
+
+    def test_isImageSaved(self):
+        print '\n', '#'*73, '\n', 'test_isImageSaved', '\n', '#'*73
+        path = tempfile.mkdtemp()
+        filename = os.path.join(path, 'Example.png')
+        with open(filename, 'wb') as f:
+            f.write('PNG' * 1000)
+        sha1 = '7b6609c64f558e720dfa2dabbd83c1d357adcf80'
+        try:
+            self.assertTrue(isImageSaved(filename=filename, size='3000', sha1=sha1))
+            self.assertTrue(isImageSaved(filename=filename, size='3000', sha1=''))
+            self.assertTrue(isImageSaved(filename=filename, size='', sha1=sha1.upper()))
+            self.assertFalse(isImageSaved(filename=filename, size='2999', sha1=sha1))
+            self.assertFalse(isImageSaved(filename=filename, size='3000', sha1='0' * 40))
+            # nothing known about the file: always download it again
+            self.assertFalse(isImageSaved(filename=filename, size='', sha1=''))
+            self.assertFalse(isImageSaved(filename=filename + '.missing', size='3000', sha1=sha1))
+        finally:
+            shutil.rmtree(path)
+
     def test_getImages(self):
         # This test download the image list using API and index.php
         # Compare both lists in length and file by file
@@ -108,7 +573,7 @@ class TestDumpgenerator(unittest.TestCase):
             print 'Trying to parse', filetocheck, 'with API'
             result_api = getImageNames(config=config_api, session=session)
             self.assertEqual(len(result_api), imagecount)
-            self.assertTrue(filetocheck in [filename for filename, url, uploader in result_api])
+            self.assertTrue(filetocheck in [filename for filename, url, uploader, size, sha1 in result_api])
             
             # Testing with index
             print '\nTesting', index
@@ -125,13 +590,13 @@ class TestDumpgenerator(unittest.TestCase):
     
             print 'Trying to parse', filetocheck, 'with index'
             result_index = getImageNames(config=config_index, session=session)
-            #print 111, set([filename for filename, url, uploader in result_api]) - set([filename for filename, url, uploader in result_index])
+            #print 111, set([filename for filename, url, uploader, size, sha1 in result_api]) - set([filename for filename, url, uploader, size, sha1 in result_index])
             self.assertEqual(len(result_index), imagecount)
-            self.assertTrue(filetocheck in [filename for filename, url, uploader in result_index])
+            self.assertTrue(filetocheck in [filename for filename, url, uploader, size, sha1 in result_index])
             
             # Compare every image in both lists, with/without API
             c = 0
-            for filename_api, url_api, uploader_api in result_api:
+            for filename_api, url_api, uploader_api, size_api, sha1_api in result_api:
                 self.assertEqual(filename_api, result_index[c][0], u'{0} and {1} are different'.format(filename_api, result_index[c][0]))
                 self.assertEqual(url_api, result_index[c][1], u'{0} and {1} are different'.format(url_api, result_index[c][1]))
                 self.assertEqual(uploader_api, result_index[c][2], u'{0} and {1} are different'.format(uploader_api, result_index[c][2]))
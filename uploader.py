@@ -22,8 +22,6 @@ import re
 import subprocess
 import sys
 import time
-import urllib
-import urllib2
 import urlparse
 import StringIO
 from xml.sax.saxutils import quoteattr
@@ -44,7 +42,7 @@ def log(wiki, dump, msg, config={}):
     f.close()
 
 def upload(wikis, config={}, uploadeddumps=[]):
-    headers = {'User-Agent': dumpgenerator.getUserAgent()}
+    session = dumpgenerator.createSession()
     dumpdir = config.wikidump_dir
 
     filelist = os.listdir(dumpdir)
@@ -115,13 +113,9 @@ def upload(wikis, config={}, uploadeddumps=[]):
                 #get metadata from api.php
                 #first sitename and base url
                 params = {'action': 'query', 'meta': 'siteinfo', 'format': 'xml'}
-                data = urllib.urlencode(params)
-                req = urllib2.Request(url=wiki, data=data, headers=headers)
                 xml = ''
                 try:
-                    f = urllib2.urlopen(req, timeout=10)
-                    xml = f.read()
-                    f.close()
+                    xml = session.post(url=wiki, data=params, timeout=10).text
                 except:
                     pass
 
@@ -150,13 +144,9 @@ def upload(wikis, config={}, uploadeddumps=[]):
 
                 #now copyright info from API
                 params = {'action': 'query', 'siprop': 'general|rightsinfo', 'format': 'xml'}
-                data = urllib.urlencode(params)
-                req = urllib2.Request(url=wiki, data=data, headers=headers)
                 xml = ''
                 try:
-                    f = urllib2.urlopen(req, timeout=10)
-                    xml = f.read()
-                    f.close()
+                    xml = session.post(url=wiki, data=params, timeout=10).text
                 except:
                     pass
 
@@ -170,9 +160,7 @@ def upload(wikis, config={}, uploadeddumps=[]):
 
                 raw = ''
                 try:
-                    f = urllib.urlopen(baseurl, timeout=10)
-                    raw = f.read()
-                    f.close()
+                    raw = session.get(url=baseurl, timeout=10).text
                 except:
                     pass
 
@@ -238,7 +226,7 @@ def upload(wikis, config={}, uploadeddumps=[]):
                 uploadeddumps.append(dump)
                 log(wiki, dump, 'ok', config)
                 if logourl:
-                    logo = StringIO.StringIO(urllib.urlopen(urlparse.urljoin(wiki, logourl), timeout=10).read())
+                    logo = StringIO.StringIO(session.get(url=urlparse.urljoin(wiki, logourl), timeout=10).content)
                     logoextension = logourl.split('.')[-1] if logourl.split('.') else 'unknown'
                     logo.name = 'wiki-' + wikiname + '_logo.' + logoextension
                     item.upload(logo, access_key=accesskey, secret_key=secretkey, verbose=True)